@@ -0,0 +1,135 @@
+"""
+Async access to the SQLite cache for code running on the event loop.
+
+Writes go through one dedicated writer thread fed by a queue: SQLite allows a
+single writer anyway, so serializing writes in-process avoids lock contention,
+and consecutive `database.upsert_issues` calls queued by concurrent scans are
+coalesced into one transaction (up to DB_WRITE_BATCH_ROWS rows). Reads run on
+a bounded pool of DB_READ_THREADS threads. Either way the event loop only
+awaits a future and never blocks on SQLite I/O.
+
+    rows = await async_db.read(database.get_all_issue_ids, repo)
+    await async_db.write(database.upsert_issues, rows)
+
+Both start lazily on first use; call `shutdown()` to flush pending writes.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+import database
+import metrics
+
+READ_THREADS = int(os.getenv("DB_READ_THREADS", "4"))
+WRITE_BATCH_ROWS = int(os.getenv("DB_WRITE_BATCH_ROWS", "5000"))
+
+_WriteJob = namedtuple("_WriteJob", ["fn", "args", "context", "loop", "future"])
+_STOP = object()
+
+_queue: "queue.Queue[Any]" = queue.Queue()
+_writer: Optional[threading.Thread] = None
+_readers: Optional[ThreadPoolExecutor] = None
+_start_lock = threading.Lock()
+
+def _ensure_started():
+    global _writer, _readers
+    with _start_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run_writer, name="db-writer", daemon=True)
+            _writer.start()
+        if _readers is None:
+            _readers = ThreadPoolExecutor(max_workers=READ_THREADS, thread_name_prefix="db-read")
+
+async def read(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Runs a database read on the read pool, keeping the caller's trace context."""
+    _ensure_started()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_readers, call)
+
+async def write(fn: Callable[..., Any], *args: Any) -> Any:
+    """Queues a database write for the writer thread and waits for its result."""
+    _ensure_started()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _queue.put(_WriteJob(fn, args, contextvars.copy_context(), loop, future))
+    metrics.DB_WRITE_QUEUE_DEPTH.inc()
+    return await future
+
+async def shutdown():
+    """Waits for queued writes to finish and stops the writer thread and read pool."""
+    global _writer, _readers
+    with _start_lock:
+        writer, readers = _writer, _readers
+        _writer, _readers = None, None
+    if writer is not None and writer.is_alive():
+        _queue.put(_STOP)
+        await asyncio.get_running_loop().run_in_executor(None, writer.join)
+    if readers is not None:
+        readers.shutdown(wait=False)
+
+def _resolve(job: _WriteJob, result: Any = None, error: Optional[BaseException] = None):
+    def settle():
+        if job.future.done():  # Caller was cancelled
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+    try:
+        job.loop.call_soon_threadsafe(settle)
+    except RuntimeError:
+        pass  # The caller's loop is closed; nobody is waiting
+
+def _run_job(job: _WriteJob):
+    try:
+        _resolve(job, job.context.run(job.fn, *job.args))
+    except Exception as e:
+        _resolve(job, error=e)
+
+def _run_batch(batch: List[_WriteJob]):
+    if len(batch) == 1:
+        _run_job(batch[0])
+        return
+    rows = [row for job in batch for row in job.args[0]]
+    try:
+        batch[0].context.run(database.upsert_issues, rows)
+    except Exception:
+        # Don't fail every scan in the batch for one bad row: retry each on its own
+        for job in batch:
+            _run_job(job)
+        return
+    for job in batch:
+        _resolve(job)
+
+def _run_writer():
+    pending = None
+    while True:
+        job = pending if pending is not None else _queue.get()
+        pending = None
+        if job is _STOP:
+            return
+
+        batch = [job]
+        if job.fn is database.upsert_issues:
+            rows = len(job.args[0])
+            while rows < WRITE_BATCH_ROWS:
+                try:
+                    queued = _queue.get_nowait()
+                except queue.Empty:
+                    break
+                if queued is _STOP or queued.fn is not database.upsert_issues:
+                    # Keeps write order: handled right after this batch
+                    pending = queued
+                    break
+                batch.append(queued)
+                rows += len(queued.args[0])
+
+        metrics.DB_WRITE_QUEUE_DEPTH.dec(len(batch))
+        metrics.DB_WRITE_BATCH_JOBS.observe(len(batch))
+        _run_batch(batch)
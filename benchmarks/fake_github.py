@@ -0,0 +1,161 @@
+"""
+Local stand-in for the GitHub issues API, serving synthetic repos for benchmarks.
+
+A repo named `<owner>/issues-<N>` (e.g. `bench/issues-10000`) has N items, every
+tenth of which is a pull request. Items are generated on the fly from their
+index, so 100k-issue repos cost no memory. Responses carry Link pagination
+and X-RateLimit-* headers like the real API.
+
+Environment:
+    FAKE_GITHUB_LATENCY_MS   Added latency per page (default 0)
+    FAKE_GITHUB_RATE_LIMIT   Requests allowed per window (default effectively unlimited)
+
+Run: uvicorn benchmarks.fake_github:app --port 9001
+"""
+import asyncio
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request, Response
+
+LATENCY_MS = float(os.getenv("FAKE_GITHUB_LATENCY_MS", "0"))
+RATE_LIMIT = int(os.getenv("FAKE_GITHUB_RATE_LIMIT", str(10**9)))
+RATE_LIMIT_WINDOW = 3600
+PR_EVERY = 10
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+_REPO_RE = re.compile(r"^issues-(\d+)$")
+_LABELS = ["bug", "enhancement", "documentation", "question", "performance", "good first issue"]
+
+BODY_TEMPLATE = """<!-- Thanks for reporting! Please fill in the template below. -->
+### Describe the bug
+
+Calling `client.fetch()` on item {index} fails intermittently under load.
+
+### Steps to reproduce
+
+1. Start the service
+2. Send {index} concurrent requests
+
+### Logs
+
+```
+{trace}
+RuntimeError: connection pool exhausted (item {index})
+```
+
+### Checklist
+
+- [x] I have searched existing issues
+- [x] I am on the latest version
+"""
+
+app = FastAPI()
+
+_rate_state = {"remaining": RATE_LIMIT, "reset": time.time() + RATE_LIMIT_WINDOW}
+
+def _timestamp(index: int) -> str:
+    return (EPOCH + timedelta(hours=index)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def make_item(owner: str, repo: str, index: int) -> Dict[str, Any]:
+    """Builds the item at `index` with the full shape of a GitHub issue payload."""
+    number = index + 1
+    trace = "\n".join(f'  File "app/module_{f}.py", line {10 + f}, in handler' for f in range(index % 40))
+    item: Dict[str, Any] = {
+        "url": f"https://api.github.com/repos/{owner}/{repo}/issues/{number}",
+        "html_url": f"https://github.com/{owner}/{repo}/issues/{number}",
+        "id": 10_000_000 + index,
+        "node_id": f"I_kwDO{index:010d}",
+        "number": number,
+        "title": f"Synthetic issue {number}: intermittent failure in component {index % 17}",
+        "user": {"login": f"user{index % 97}", "id": index % 97, "type": "User", "site_admin": False},
+        "labels": [
+            {"id": 1000 + i, "name": name, "color": "ededed", "default": False}
+            for i, name in enumerate(_LABELS) if (index >> i) % 3 == 0
+        ],
+        "state": "open",
+        "locked": False,
+        "assignees": [{"login": f"maintainer{index % 5}", "id": 500 + index % 5}] if index % 4 == 0 else [],
+        "milestone": None,
+        "comments": index % 23,
+        "created_at": _timestamp(index),
+        "updated_at": _timestamp(index + 24),
+        "closed_at": None,
+        "author_association": "NONE",
+        "body": BODY_TEMPLATE.format(index=index, trace=trace),
+        "reactions": {
+            "total_count": index % 11,
+            "+1": index % 7,
+            "-1": 0,
+            "laugh": 0,
+            "hooray": 0,
+            "confused": 0,
+            "heart": index % 4,
+            "rocket": 0,
+            "eyes": 0,
+        },
+    }
+    if index % PR_EVERY == PR_EVERY - 1:
+        item["pull_request"] = {"url": f"https://api.github.com/repos/{owner}/{repo}/pulls/{number}"}
+    return item
+
+def _first_index_since(since: str) -> int:
+    # updated_at grows with the index, so `since` selects a suffix of the repo
+    cutoff = datetime.strptime(since, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    hours = (cutoff - EPOCH).total_seconds() / 3600 - 24
+    return max(0, int(-(-hours // 1)))
+
+def _consume_rate_limit() -> Tuple[bool, Dict[str, str]]:
+    now = time.time()
+    if now >= _rate_state["reset"]:
+        _rate_state["remaining"] = RATE_LIMIT
+        _rate_state["reset"] = now + RATE_LIMIT_WINDOW
+    allowed = _rate_state["remaining"] > 0
+    if allowed:
+        _rate_state["remaining"] -= 1
+    return allowed, {
+        "X-RateLimit-Limit": str(RATE_LIMIT),
+        "X-RateLimit-Remaining": str(_rate_state["remaining"]),
+        "X-RateLimit-Reset": str(int(_rate_state["reset"])),
+    }
+
+@app.get("/repos/{owner}/{repo}/issues")
+async def list_issues(
+    owner: str,
+    repo: str,
+    request: Request,
+    response: Response,
+    state: str = "open",
+    per_page: int = 30,
+    page: int = 1,
+    since: Optional[str] = None,
+):
+    match = _REPO_RE.match(repo)
+    if not match:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    allowed, headers = _consume_rate_limit()
+    if not allowed:
+        raise HTTPException(status_code=403, detail="API rate limit exceeded", headers=headers)
+
+    if LATENCY_MS:
+        await asyncio.sleep(LATENCY_MS / 1000)
+
+    total = int(match.group(1))
+    first = _first_index_since(since) if since else 0
+    per_page = max(1, min(per_page, 100))
+    start = first + (page - 1) * per_page
+    items = [make_item(owner, repo, i) for i in range(start, min(start + per_page, total))]
+
+    last_page = max(1, -(-(total - first) // per_page))
+    if page < last_page:
+        headers["Link"] = (
+            f'<{request.url.include_query_params(page=page + 1)}>; rel="next", '
+            f'<{request.url.include_query_params(page=last_page)}>; rel="last"'
+        )
+
+    response.headers.update(headers)
+    return items
@@ -0,0 +1,108 @@
+"""
+Local stand-in for the LLM providers, speaking the wire formats llm_client uses:
+
+    POST /v1/responses                           OpenAI Responses API
+    POST /v1/messages                            Anthropic Messages API
+    POST /v1beta/models/{model}:generateContent  Gemini
+    POST /v1/chat/completions                    Ollama (OpenAI-compatible)
+
+Environment:
+    FAKE_LLM_LATENCY_MS            Base latency per call (default 200)
+    FAKE_LLM_LATENCY_PER_1K_TOKENS Extra latency per 1k input tokens (default 0)
+    FAKE_LLM_429_RATE              Fraction of calls answered with 429 (default 0)
+
+Run: uvicorn benchmarks.fake_llm:app --port 9002
+"""
+import asyncio
+import os
+import random
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "200"))
+LATENCY_PER_1K_TOKENS = float(os.getenv("FAKE_LLM_LATENCY_PER_1K_TOKENS", "0"))
+RATE_429 = float(os.getenv("FAKE_LLM_429_RATE", "0"))
+OUTPUT_TEXT = "Synthetic summary: recurring connection pool exhaustion under load; request timeouts; missing docs."
+
+app = FastAPI()
+
+_rng = random.Random(0)
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+async def _simulate(prompt_text: str):
+    """Sleeps for the configured latency; returns a 429 response if this call is throttled."""
+    if RATE_429 and _rng.random() < RATE_429:
+        return JSONResponse({"error": {"message": "Rate limit exceeded"}}, status_code=429, headers={"retry-after": "1"})
+    tokens = _estimate_tokens(prompt_text)
+    await asyncio.sleep((LATENCY_MS + LATENCY_PER_1K_TOKENS * tokens / 1000) / 1000)
+    return None
+
+def _text_of(content: Any) -> str:
+    # Message content is either a string or a list of typed blocks
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content or [])
+
+@app.post("/v1/responses")
+async def openai_responses(request: Request):
+    payload: Dict[str, Any] = await request.json()
+    prompt = payload.get("input")
+    prompt = prompt if isinstance(prompt, str) else "".join(_text_of(m.get("content")) for m in prompt or [])
+    throttled = await _simulate(prompt)
+    if throttled:
+        return throttled
+    return {
+        "object": "response",
+        "model": payload.get("model"),
+        "output_text": OUTPUT_TEXT,
+        "usage": {"input_tokens": _estimate_tokens(prompt), "output_tokens": _estimate_tokens(OUTPUT_TEXT)},
+    }
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    payload: Dict[str, Any] = await request.json()
+    prompt = _text_of(payload.get("system")) + "".join(_text_of(m.get("content")) for m in payload.get("messages", []))
+    throttled = await _simulate(prompt)
+    if throttled:
+        return throttled
+    return {
+        "type": "message",
+        "role": "assistant",
+        "model": payload.get("model"),
+        "content": [{"type": "text", "text": OUTPUT_TEXT}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": _estimate_tokens(prompt), "output_tokens": _estimate_tokens(OUTPUT_TEXT)},
+    }
+
+@app.post("/v1beta/models/{model_action}")
+async def gemini_generate(model_action: str, request: Request):
+    payload: Dict[str, Any] = await request.json()
+    prompt = "".join(part.get("text", "") for c in payload.get("contents", []) for part in c.get("parts", []))
+    throttled = await _simulate(prompt)
+    if throttled:
+        return throttled
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": OUTPUT_TEXT}]}, "finishReason": "STOP"}],
+        "usageMetadata": {
+            "promptTokenCount": _estimate_tokens(prompt),
+            "candidatesTokenCount": _estimate_tokens(OUTPUT_TEXT),
+        },
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload: Dict[str, Any] = await request.json()
+    prompt = "".join(_text_of(m.get("content")) for m in payload.get("messages", []))
+    throttled = await _simulate(prompt)
+    if throttled:
+        return throttled
+    return {
+        "object": "chat.completion",
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": OUTPUT_TEXT}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": _estimate_tokens(prompt), "completion_tokens": _estimate_tokens(OUTPUT_TEXT)},
+    }
@@ -0,0 +1,172 @@
+"""
+End-to-end benchmark: runs the service against local fake GitHub and LLM servers
+and reports scan throughput, /analyze latency percentiles and peak RSS.
+
+Usage:
+    python -m benchmarks.run --sizes 1000,10000 --provider anthropic --output bench.json
+
+Nothing leaves the machine: the service gets a throwaway working directory (so a
+fresh issues.db) and every provider/GitHub URL points at the local fakes.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Env vars that select the provider in llm_client.get_llm_client()
+PROVIDER_ENV = {
+    "openai": lambda url: {"OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": f"{url}/v1"},
+    "anthropic": lambda url: {"ANTHROPIC_API_KEY": "bench", "ANTHROPIC_BASE_URL": url},
+    "gemini": lambda url: {"GEMINI_API_KEY": "bench", "GEMINI_BASE_URL": url},
+    "ollama": lambda url: {"OLLAMA_BASE_URL": f"{url}/v1", "OLLAMA_MODEL": "bench"},
+}
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _start_server(app: str, port: int, env: Dict[str, str], cwd: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", ROOT, "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+        cwd=cwd,
+    )
+
+def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start")
+
+def _peak_rss_mb(pid: int) -> Optional[float]:
+    # VmHWM is the process's resident-set high-water mark (Linux only)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 1)
+
+def _git_version() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def bench_size(app_url: str, size: int, analyze_requests: int, analyze_concurrency: int) -> Dict[str, Any]:
+    repo = f"bench/issues-{size}"
+    with httpx.Client(base_url=app_url, timeout=None) as client:
+        start = time.perf_counter()
+        response = client.post("/scan", json={"repo": repo})
+        scan_seconds = time.perf_counter() - start
+        response.raise_for_status()
+        fetched = response.json()["issues_fetched"]
+
+        def analyze(_) -> float:
+            t0 = time.perf_counter()
+            r = client.post("/analyze", json={"repo": repo, "prompt": "What are the most common failure modes?"})
+            r.raise_for_status()
+            return (time.perf_counter() - t0) * 1000
+
+        with ThreadPoolExecutor(max_workers=analyze_concurrency) as pool:
+            latencies = list(pool.map(analyze, range(analyze_requests)))
+
+    return {
+        "repo": repo,
+        "issues": fetched,
+        "scan_seconds": round(scan_seconds, 3),
+        "scan_issues_per_second": round(fetched / scan_seconds, 1) if scan_seconds else None,
+        "analyze_requests": len(latencies),
+        "analyze_p50_ms": _percentile(latencies, 50),
+        "analyze_p99_ms": _percentile(latencies, 99),
+    }
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000", help="Comma-separated repo sizes (issues + PRs)")
+    parser.add_argument("--provider", choices=sorted(PROVIDER_ENV), default="anthropic")
+    parser.add_argument("--analyze-requests", type=int, default=10)
+    parser.add_argument("--analyze-concurrency", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--github-latency-ms", type=float, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    github_port, llm_port, app_port = _free_port(), _free_port(), _free_port()
+    github_url = f"http://127.0.0.1:{github_port}"
+    llm_url = f"http://127.0.0.1:{llm_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    # Blank out every provider so a local .env can't redirect the benchmark to a real API
+    app_env = {key: "" for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "OLLAMA_BASE_URL", "GITHUB_TOKEN")}
+    app_env.update(PROVIDER_ENV[args.provider](llm_url))
+    app_env.update({"GITHUB_API_URL": github_url, "REFRESH_ENABLED": "false"})
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            processes.append(_start_server("benchmarks.fake_github:app", github_port, {
+                "FAKE_GITHUB_LATENCY_MS": str(args.github_latency_ms),
+            }, ROOT))
+            processes.append(_start_server("benchmarks.fake_llm:app", llm_port, {
+                "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+                "FAKE_LLM_429_RATE": str(args.llm_429_rate),
+            }, ROOT))
+            app_process = _start_server("main:app", app_port, app_env, workdir)
+            processes.append(app_process)
+            for url in (github_url, llm_url, app_url):
+                _wait_ready(url)
+
+            results = [
+                bench_size(app_url, int(size), args.analyze_requests, args.analyze_concurrency)
+                for size in args.sizes.split(",")
+            ]
+            report = {
+                "version": _git_version(),
+                "python": platform.python_version(),
+                "provider": args.provider,
+                "llm_latency_ms": args.llm_latency_ms,
+                "llm_429_rate": args.llm_429_rate,
+                "github_latency_ms": args.github_latency_ms,
+                "results": results,
+                "peak_rss_mb": round(_peak_rss_mb(app_process.pid) or 0, 1) or None,
+            }
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=10)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Record/replay layer for outgoing LLM provider and GitHub calls.
+
+With CASSETTE_MODE=record, every call wrapped by `recorded()` runs for real and
+its result and latency are stored in CASSETTE_FILE (SQLite). With
+CASSETTE_MODE=replay, calls never leave the process: the stored result is
+returned after sleeping for the recorded latency (scaled by
+CASSETTE_LATENCY_SCALE, 0 to disable), and unrecorded calls raise CassetteMiss.
+The default, CASSETTE_MODE=off, is a straight pass-through.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Tuple
+
+import httpx
+
+MODE = os.getenv("CASSETTE_MODE", "off").lower()  # off | record | replay
+CASSETTE_FILE = os.getenv("CASSETTE_FILE", "cassettes.db")
+LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0"))
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a call that was never recorded."""
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(CASSETTE_FILE, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cassettes (
+            key TEXT PRIMARY KEY,
+            namespace TEXT NOT NULL,
+            request TEXT NOT NULL,
+            response TEXT NOT NULL,
+            latency REAL NOT NULL,
+            recorded_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def _request_key(namespace: str, request: Any) -> Tuple[str, str]:
+    serialized = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(f"{namespace}\0{serialized}".encode("utf-8")).hexdigest(), serialized
+
+def _save(namespace: str, key: str, request: str, response: Any, latency: float):
+    conn = _connect()
+    conn.execute(
+        "INSERT OR REPLACE INTO cassettes (key, namespace, request, response, latency, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (key, namespace, request, json.dumps(response), latency, time.time())
+    )
+    conn.commit()
+    conn.close()
+
+def _load(namespace: str, key: str) -> Tuple[Any, float]:
+    conn = _connect()
+    row = conn.execute("SELECT response, latency FROM cassettes WHERE key = ?", (key,)).fetchone()
+    conn.close()
+    if row is None:
+        raise CassetteMiss(f"No recorded {namespace} call for key {key[:12]}")
+    return json.loads(row[0]), row[1] * LATENCY_SCALE
+
+# --- Codecs: how a call's result is stored and rebuilt ---
+
+# The body is stored decoded, so headers describing the wire encoding no longer apply
+_WIRE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+def _encode_response(response: httpx.Response) -> Any:
+    return {
+        "status_code": response.status_code,
+        "headers": [(k, v) for k, v in response.headers.items() if k.lower() not in _WIRE_HEADERS],
+        "content": response.content.decode("utf-8", "replace"),
+        "url": str(response.request.url) if response.request else None,
+    }
+
+def _decode_response(data: Any) -> httpx.Response:
+    return httpx.Response(
+        data["status_code"],
+        headers=data["headers"],
+        content=data["content"].encode("utf-8"),
+        request=httpx.Request("GET", data["url"] or "http://cassette.invalid"),
+    )
+
+CODECS = {
+    "json": (lambda result: result, lambda data: data),
+    "response": (_encode_response, _decode_response),
+}
+
+def recorded(namespace: str, key: Callable[..., Any], codec: str = "json"):
+    """
+    Wraps a sync or async call for record/replay.
+    `key` receives the call's arguments and returns the JSON-able parts that
+    identify the request (leave out clients, credentials and other live objects).
+    """
+    encode, decode = CODECS[codec]
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if MODE == "off":
+                    return await fn(*args, **kwargs)
+                request_key, request = _request_key(namespace, key(*args, **kwargs))
+                if MODE == "replay":
+                    data, latency = _load(namespace, request_key)
+                    await asyncio.sleep(latency)
+                    return decode(data)
+                started = time.perf_counter()
+                result = await fn(*args, **kwargs)
+                _save(namespace, request_key, request, encode(result), time.perf_counter() - started)
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if MODE == "off":
+                return fn(*args, **kwargs)
+            request_key, request = _request_key(namespace, key(*args, **kwargs))
+            if MODE == "replay":
+                data, latency = _load(namespace, request_key)
+                time.sleep(latency)
+                return decode(data)
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            _save(namespace, request_key, request, encode(result), time.perf_counter() - started)
+            return result
+        return wrapper
+
+    return decorator
@@ -1,41 +1,198 @@
+import asyncio
+import contextvars
+import json
+import math
+import os
+import time
 import httpx
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Any, Optional
+from urllib.parse import urlparse
+
+import cassette
+import metrics
+import tracing
+
+try:
+    import orjson
+except ImportError:  # Optional dependency; the stdlib parser is used without it
+    orjson = None
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+
+# Top-level issue fields the cache uses; everything else in the payload is dropped right after parsing
+ISSUE_FIELDS = ("id", "number", "title", "body", "html_url", "created_at", "updated_at", "state", "comments")
+
+def _loads(content: bytes) -> Any:
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+def _project_issue(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keeps only the cached fields, with nested objects trimmed to the keys the cache
+    reads, so a scan retains a few small dicts per issue instead of the full payload.
+    """
+    issue = {field: item.get(field) for field in ISSUE_FIELDS}
+    issue["labels"] = [{"name": label.get("name")} for label in item.get("labels") or ()]
+    issue["assignees"] = [{"login": assignee.get("login")} for assignee in item.get("assignees") or ()]
+    issue["reactions"] = {"total_count": (item.get("reactions") or {}).get("total_count", 0)}
+    return issue
+
+class RateLimitExhausted(RuntimeError):
+    """GitHub's rate-limit budget is spent until `reset_at` (epoch seconds, if known)."""
+
+    def __init__(self, reset_at: Optional[float]):
+        super().__init__("GitHub rate limit exhausted")
+        self.reset_at = reset_at
+
+    def retry_after(self) -> int:
+        """Seconds until the rate-limit window resets, for a Retry-After header."""
+        if self.reset_at is None:
+            return 60
+        return max(1, math.ceil(self.reset_at - time.time()))
+
+class RequestBudgetExhausted(RuntimeError):
+    """The metered caller's request budget is spent (see `metered_requests`)."""
+
+class RequestMeter:
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.count = 0
+
+    def charge(self):
+        """Counts one page request, refusing once the limit is reached."""
+        if self.limit is not None and self.count >= self.limit:
+            raise RequestBudgetExhausted(f"Request budget of {self.limit} spent")
+        self.count += 1
+
+_meter: contextvars.ContextVar[Optional[RequestMeter]] = contextvars.ContextVar("github_request_meter", default=None)
+
+@contextmanager
+def metered_requests(limit: Optional[int] = None) -> Iterator[RequestMeter]:
+    """
+    Counts the GitHub page requests made by the current task (and what it awaits),
+    stopping with RequestBudgetExhausted before the request that would exceed `limit`.
+    Requests from other tasks, e.g. concurrent foreground scans, aren't counted.
+    """
+    meter = RequestMeter(limit)
+    token = _meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _meter.reset(token)
+
+def charge_request():
+    """Charges one request to the current meter, if any."""
+    meter = _meter.get()
+    if meter is not None:
+        meter.charge()
 
 class GitHubClient:
-    async def fetch_open_issues(self, repo: str) -> List[Dict[str, Any]]:
-        url = f"https://api.github.com/repos/{repo}/issues"
+    def __init__(self, per_host_concurrency: Optional[int] = None):
+        # Caps in-flight page requests per API host, shared by every scan in the process
+        self.per_host_concurrency = per_host_concurrency or int(os.getenv("GITHUB_PER_HOST_CONCURRENCY", "8"))
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        # Rate-limit budget as last reported by GitHub, shared by every scan in the process
+        self.rate_limit_remaining: Optional[int] = None
+        self.rate_limit_reset: Optional[float] = None
+        # Total page requests sent
+        self.requests_made = 0
+
+    def _headers(self) -> Dict[str, str]:
+        token = os.getenv("GITHUB_TOKEN")
+        return {"Authorization": f"Bearer {token}"} if token else {}
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_limits[host]
+
+    def _record_rate_limit(self, response):
+        remaining = response.headers.get("x-ratelimit-remaining")
+        reset = response.headers.get("x-ratelimit-reset")
+        if remaining is not None:
+            self.rate_limit_remaining = int(remaining)
+        if reset is not None:
+            self.rate_limit_reset = float(reset)
+
+    def rate_limit_exhausted(self) -> bool:
+        """True while GitHub has reported no remaining requests and the window hasn't reset."""
+        return (
+            self.rate_limit_remaining == 0
+            and self.rate_limit_reset is not None
+            and self.rate_limit_reset > time.time()
+        )
+
+    async def fetch_open_issues(self, repo: str, client: Optional[httpx.AsyncClient] = None) -> List[Dict[str, Any]]:
+        """
+        Fetches all open issues (excluding pull requests) for a repo.
+        Pass a shared `client` to reuse its connection pool across many scans.
+        """
+        return await self._fetch(repo, {"state": "open"}, client)
+
+    async def fetch_issues_since(self, repo: str, since: str, client: Optional[httpx.AsyncClient] = None) -> List[Dict[str, Any]]:
+        """
+        Fetches issues of any state updated at or after `since` (ISO 8601), for
+        incremental refreshes. Closed issues are included so they can be pruned.
+        """
+        return await self._fetch(repo, {"state": "all", "since": since}, client)
+
+    async def _fetch(self, repo: str, filters: Dict[str, str], client: Optional[httpx.AsyncClient]) -> List[Dict[str, Any]]:
+        if client is None:
+            async with httpx.AsyncClient(follow_redirects=True) as client:
+                return await self._fetch_issues(client, repo, filters)
+        return await self._fetch_issues(client, repo, filters)
+
+    @cassette.recorded("github", key=lambda self, client, url, params: (url, params), codec="response")
+    async def _get_page(self, client: httpx.AsyncClient, url: str, params: Dict[str, Any]) -> httpx.Response:
+        return await client.get(url, params=params, headers=self._headers())
+
+    async def _fetch_issues(self, client: httpx.AsyncClient, repo: str, filters: Dict[str, str]) -> List[Dict[str, Any]]:
+        url = f"{GITHUB_API_URL}/repos/{repo}/issues"
         params = {
-            "state": "open",
+            **filters,
             "per_page": 100,
             "page": 1
         }
         all_issues = []
-        
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            while True:
-                response = await client.get(url, params=params)
-                if response.status_code != 200:
-                    # If repo not found or other error, decided to raise or return empty.
-                    # Prompt says "Exclude pull requests"
-                    # For simplicity, if error, we stop and return what we have or raise.
-                    # Let's log/print and break for robustness, or raise if it's the first page (repo likely invalid).
-                    if params["page"] == 1:
-                        response.raise_for_status() 
-                    break
 
-                data = response.json()
+        while True:
+            if self.rate_limit_exhausted():
+                raise RateLimitExhausted(self.rate_limit_reset)
+            charge_request()
+
+            async with self._host_limit(url):
+                with tracing.span("github.page", repo=repo, page=params["page"]) as page_span:
+                    started = time.perf_counter()
+                    response = await self._get_page(client, url, dict(params))
+                    metrics.GITHUB_PAGE_SECONDS.observe(time.perf_counter() - started, status=str(response.status_code))
+                    page_span.set(status=response.status_code)
+            self.requests_made += 1
+            self._record_rate_limit(response)
+
+            if response.status_code in (403, 429) and self.rate_limit_exhausted():
+                raise RateLimitExhausted(self.rate_limit_reset)
+            if response.status_code != 200:
+                # If repo not found or other error, decided to raise or return empty.
+                # Prompt says "Exclude pull requests"
+                # For simplicity, if error, we stop and return what we have or raise.
+                # Let's log/print and break for robustness, or raise if it's the first page (repo likely invalid).
+                if params["page"] == 1:
+                    response.raise_for_status()
+                break
+
+            with tracing.span("github.decode_page"):
+                data = _loads(response.content)
                 if not data:
                     break
-                
-                for item in data:
-                    if "pull_request" not in item:
-                        all_issues.append(item)
-                
-                # Check for next page
-                if "next" not in response.headers.get("link", ""):
-                    break
-                
-                params["page"] += 1
-                
+                all_issues.extend(_project_issue(item) for item in data if "pull_request" not in item)
+
+            # Check for next page
+            if "next" not in response.headers.get("link", ""):
+                break
+
+            params["page"] += 1
+
+        metrics.GITHUB_PAGES_PER_SCAN.observe(params["page"])
         return all_issues
 
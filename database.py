@@ -1,15 +1,191 @@
+import hashlib
+import os
+import re
 import sqlite3
-from typing import List, Dict, Any, Optional
+import time
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Sequence, Callable, Tuple
+
+import metrics
+import tracing
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, only needed for ISSUE_BODY_COMPRESSION=zstd
+    zstandard = None
 
 DB_FILE = "issues.db"
 
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
+# Storage layout for issues: "none" keeps them in DB_FILE, "repo" gives every repo its own
+# file and "hash" spreads repos over DB_SHARD_COUNT files. DB_FILE is always the catalog:
+# repo bookkeeping, cached summaries and the repo -> shard map live there.
+SHARDING = os.getenv("DB_SHARDING", "none").lower()
+SHARD_COUNT = int(os.getenv("DB_SHARD_COUNT", "16"))
+SHARD_DIR = os.getenv("DB_SHARD_DIR")  # Defaults to a "shards" directory next to DB_FILE
+
+ISSUE_COLUMNS = ("id", "repo", "title", "body", "html_url", "created_at", "prompt_text", "updated_at", "comments", "reactions")
+DEFAULT_BATCH_SIZE = 500
+
+# Issue bodies dominate the size of the cache. When enabled, they are stored as
+# compressed BLOBs and decompressed only when the body column is actually read.
+BODY_COMPRESSION = os.getenv("ISSUE_BODY_COMPRESSION", "none").lower()  # none | zlib | zstd
+# Optional dictionary trained with train_zstd_dictionary(), used for new bodies. Every dictionary
+# used is also kept in the catalog by its dict_id, which zstd records in each frame, so bodies
+# stay readable after the setting changes.
+ZSTD_DICT_FILE = os.getenv("ISSUE_BODY_ZSTD_DICT")
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# (catalog, dictionary file) -> compression dictionary; (catalog, dict_id) -> decompression dictionary
+_zstd_compression_dicts: Dict[Tuple[str, str], Any] = {}
+_zstd_dicts: Dict[Tuple[str, int], Any] = {}
+
+def register_zstd_dictionary(data: bytes) -> int:
+    """Stores a dictionary in the catalog under its dict_id. Registered dictionaries are never replaced."""
+    dict_id = zstandard.ZstdCompressionDict(data).dict_id()
+    conn = _connect(DB_FILE)
+    try:
+        conn.execute("INSERT OR IGNORE INTO zstd_dictionaries (dict_id, data) VALUES (?, ?)", (dict_id, data))
+        conn.commit()
+        stored = conn.execute("SELECT data FROM zstd_dictionaries WHERE dict_id = ?", (dict_id,)).fetchone()["data"]
+    finally:
+        conn.close()
+    if bytes(stored) != data:
+        raise RuntimeError(f"A different zstd dictionary with id {dict_id} is already registered")
+    return dict_id
+
+def _get_zstd_dict():
+    """The configured compression dictionary, registered in the catalog before its first use."""
+    if not ZSTD_DICT_FILE or not os.path.exists(ZSTD_DICT_FILE):
+        return None
+    key = (DB_FILE, ZSTD_DICT_FILE)
+    if key not in _zstd_compression_dicts:
+        with open(ZSTD_DICT_FILE, "rb") as f:
+            data = f.read()
+        register_zstd_dictionary(data)
+        _zstd_compression_dicts[key] = zstandard.ZstdCompressionDict(data)
+    return _zstd_compression_dicts[key]
+
+def _zstd_frame_dict(value: bytes):
+    """The dictionary a zstd frame was compressed with, looked up by the dict_id in its header."""
+    dict_id = zstandard.get_frame_parameters(value).dict_id
+    if not dict_id:
+        return None
+    key = (DB_FILE, dict_id)
+    if key not in _zstd_dicts:
+        conn = _connect(DB_FILE)
+        row = conn.execute("SELECT data FROM zstd_dictionaries WHERE dict_id = ?", (dict_id,)).fetchone()
+        conn.close()
+        if row is None:
+            # Bodies written before dictionaries were kept in the catalog
+            configured = _get_zstd_dict()
+            if configured is None or configured.dict_id() != dict_id:
+                raise RuntimeError(f"Issue body was compressed with zstd dictionary {dict_id}, which is not in the catalog")
+            return configured
+        _zstd_dicts[key] = zstandard.ZstdCompressionDict(bytes(row["data"]))
+    return _zstd_dicts[key]
+
+def _encode_body(body: Optional[str]) -> Any:
+    """Compresses a body for storage, keeping plain text when compression doesn't pay off."""
+    if not body or BODY_COMPRESSION == "none":
+        return body
+
+    raw = body.encode("utf-8")
+    if BODY_COMPRESSION == "zlib":
+        packed = zlib.compress(raw, ZLIB_LEVEL)
+    elif BODY_COMPRESSION == "zstd":
+        if zstandard is None:
+            raise RuntimeError("ISSUE_BODY_COMPRESSION=zstd requires the 'zstandard' package")
+        packed = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_get_zstd_dict()).compress(raw)
+    else:
+        raise ValueError(f"Unknown ISSUE_BODY_COMPRESSION: {BODY_COMPRESSION}")
+
+    return packed if len(packed) < len(raw) else body
+
+def _decode_body(value: Any) -> Optional[str]:
+    """Inverse of _encode_body. Text values are returned as-is, so mixed tables read fine."""
+    if not isinstance(value, bytes):
+        return value
+    if value.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("Cached issue bodies are zstd-compressed; install the 'zstandard' package")
+        return zstandard.ZstdDecompressor(dict_data=_zstd_frame_dict(value)).decompress(value).decode("utf-8")
+    return zlib.decompress(value).decode("utf-8")
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    data = dict(row)
+    if "body" in data:
+        data["body"] = _decode_body(data["body"])
+    return data
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    conn = get_connection()
+# (catalog, repo) -> shard file, for repos already registered in the catalog
+_shard_paths: Dict[Tuple[str, str], str] = {}
+
+def _shard_file_name(repo: str) -> str:
+    digest = hashlib.sha1(repo.encode("utf-8")).hexdigest()
+    if SHARDING == "hash":
+        return f"issues-{int(digest, 16) % SHARD_COUNT:03d}.db"
+    return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', repo)}-{digest[:8]}.db"
+
+def shard_path(repo: str, create: bool = False) -> str:
+    """
+    The file holding a repo's issues. Shards are registered in the catalog by
+    the first write (`create=True`); until then reads go to the catalog, whose
+    issue tables are empty in sharded modes, so unknown repos read as empty
+    without creating files.
+    """
+    if SHARDING == "none":
+        return DB_FILE
+    key = (DB_FILE, repo)
+    if key in _shard_paths:
+        return _shard_paths[key]
+
+    conn = _connect(DB_FILE)
+    try:
+        row = conn.execute("SELECT path FROM shards WHERE repo = ?", (repo,)).fetchone()
+        if row is None:
+            if not create:
+                return DB_FILE
+            path = os.path.join(SHARD_DIR or os.path.join(os.path.dirname(os.path.abspath(DB_FILE)), "shards"), _shard_file_name(repo))
+            # Tables exist before the shard is visible to other workers
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _init_issue_tables(path)
+            conn.execute("INSERT OR IGNORE INTO shards (repo, path) VALUES (?, ?)", (repo, path))
+            conn.commit()
+            row = conn.execute("SELECT path FROM shards WHERE repo = ?", (repo,)).fetchone()
+    finally:
+        conn.close()
+    _shard_paths[key] = row["path"]
+    return row["path"]
+
+def issue_files() -> List[str]:
+    """Every file that may hold issues: the catalog and all registered shards."""
+    conn = _connect(DB_FILE)
+    paths = [row["path"] for row in conn.execute("SELECT DISTINCT path FROM shards ORDER BY path")]
+    conn.close()
+    return [DB_FILE] + [path for path in paths if path != DB_FILE]
+
+def get_connection(repo: Optional[str] = None, create: bool = False) -> sqlite3.Connection:
+    """Connection to the catalog, or to the shard holding `repo`'s issues."""
+    return _connect(DB_FILE if repo is None else shard_path(repo, create))
+
+def _ensure_column(cursor, table: str, column: str, ddl: str):
+    # CREATE TABLE IF NOT EXISTS leaves databases from older versions untouched,
+    # so columns added later are migrated in place.
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row["name"] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def _init_issue_tables(path: str):
+    conn = _connect(path)
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS issues (
@@ -18,67 +194,633 @@ def init_db():
             title TEXT,
             body TEXT,
             html_url TEXT,
-            created_at TEXT
+            created_at TEXT,
+            prompt_text TEXT,
+            updated_at TEXT,
+            comments INTEGER NOT NULL DEFAULT 0,
+            reactions INTEGER NOT NULL DEFAULT 0
         )
     """)
+    for column, ddl in (
+        ("prompt_text", "TEXT"),
+        ("updated_at", "TEXT"),
+        ("comments", "INTEGER NOT NULL DEFAULT 0"),
+        ("reactions", "INTEGER NOT NULL DEFAULT 0"),
+    ):
+        _ensure_column(cursor, "issues", column, ddl)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issues_repo ON issues (repo)")
+    # Analysis filters (see _filter_sql) are range scans within one repo
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issues_repo_created ON issues (repo, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issues_repo_updated ON issues (repo, updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issues_repo_reactions ON issues (repo, reactions)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issues_repo_comments ON issues (repo, comments)")
+    # Keyset paging by creation date (see _sort_sql)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issues_repo_created_key ON issues (repo, IFNULL(created_at, ''), id)")
+    # Labels and assignees are many-to-many, keyed by GitHub's globally unique issue id
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS issue_labels (
+            issue_id INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            PRIMARY KEY (issue_id, label)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issue_labels_label ON issue_labels (label, issue_id)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS issue_assignees (
+            issue_id INTEGER NOT NULL,
+            login TEXT NOT NULL,
+            PRIMARY KEY (issue_id, login)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_issue_assignees_login ON issue_assignees (login, issue_id)")
     conn.commit()
     conn.close()
 
-def upsert_issue(issue: Dict[str, Any]):
+def init_db():
+    _init_issue_tables(DB_FILE)
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
-        INSERT INTO issues (id, repo, title, body, html_url, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            repo=excluded.repo,
-            title=excluded.title,
-            body=excluded.body,
-            html_url=excluded.html_url,
-            created_at=excluded.created_at
-    """, (
+        CREATE TABLE IF NOT EXISTS repos (
+            repo TEXT PRIMARY KEY,
+            content_hash TEXT,
+            last_scanned_at REAL,
+            scan_count INTEGER NOT NULL DEFAULT 0,
+            change_count INTEGER NOT NULL DEFAULT 0,
+            analyze_count INTEGER NOT NULL DEFAULT 0,
+            last_analyzed_at REAL,
+            refresh_interval REAL
+        )
+    """)
+    for column, ddl in (
+        ("scan_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("change_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("analyze_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("last_analyzed_at", "REAL"),
+        ("refresh_interval", "REAL"),
+    ):
+        _ensure_column(cursor, "repos", column, ddl)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS repo_summaries (
+            repo TEXT NOT NULL,
+            prompt_key TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            PRIMARY KEY (repo, prompt_key)
+        )
+    """)
+    # Every zstd dictionary bodies were compressed with, by the dict_id recorded in each frame
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS zstd_dictionaries (
+            dict_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL
+        )
+    """)
+    # Catalog: which file holds each repo's issues when DB_SHARDING is on
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS shards (
+            repo TEXT PRIMARY KEY,
+            path TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+    # Registered shards may predate columns added since
+    for path in issue_files()[1:]:
+        _init_issue_tables(path)
+
+_UPSERT_SQL = """
+    INSERT INTO issues (id, repo, title, body, html_url, created_at, prompt_text, updated_at, comments, reactions)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        repo=excluded.repo,
+        title=excluded.title,
+        body=excluded.body,
+        html_url=excluded.html_url,
+        created_at=excluded.created_at,
+        prompt_text=excluded.prompt_text,
+        updated_at=excluded.updated_at,
+        comments=excluded.comments,
+        reactions=excluded.reactions
+"""
+
+def _upsert_params(issue: Dict[str, Any]) -> tuple:
+    return (
         issue["id"],
         issue["repo"],
         issue["title"],
-        issue.get("body", ""),
+        _encode_body(issue.get("body", "")),
         issue["html_url"],
-        issue["created_at"]
-    ))
+        issue["created_at"],
+        issue.get("prompt_text"),
+        issue.get("updated_at"),
+        issue.get("comments") or 0,
+        issue.get("reactions") or 0
+    )
+
+def _replace_links(cursor, issues: List[Dict[str, Any]]):
+    """Replaces the labels and assignees of the given issues (lists of names and logins)."""
+    ids = [(issue["id"],) for issue in issues]
+    cursor.executemany("DELETE FROM issue_labels WHERE issue_id = ?", ids)
+    cursor.executemany("DELETE FROM issue_assignees WHERE issue_id = ?", ids)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO issue_labels (issue_id, label) VALUES (?, ?)",
+        [(issue["id"], label) for issue in issues for label in issue.get("labels") or ()]
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO issue_assignees (issue_id, login) VALUES (?, ?)",
+        [(issue["id"], login) for issue in issues for login in issue.get("assignees") or ()]
+    )
+
+def upsert_issue(issue: Dict[str, Any]):
+    conn = get_connection(issue["repo"], create=True)
+    cursor = conn.cursor()
+    cursor.execute(_UPSERT_SQL, _upsert_params(issue))
+    _replace_links(cursor, [issue])
     conn.commit()
     conn.close()
 
+def upsert_issues(issues: List[Dict[str, Any]]):
+    """Upserts many issues with one transaction per shard they belong to."""
+    if not issues:
+        return
+    by_shard: Dict[str, List[Dict[str, Any]]] = {}
+    for issue in issues:
+        by_shard.setdefault(shard_path(issue["repo"], create=True), []).append(issue)
+    with metrics.DB_UPSERT_BATCH_SECONDS.time(), tracing.span("db.upsert_issues", rows=len(issues), shards=len(by_shard)):
+        for path, shard_issues in by_shard.items():
+            conn = _connect(path)
+            cursor = conn.cursor()
+            cursor.executemany(_UPSERT_SQL, [_upsert_params(issue) for issue in shard_issues])
+            _replace_links(cursor, shard_issues)
+            conn.commit()
+            conn.close()
+
 def get_issues_for_repo(repo: str) -> List[Dict[str, Any]]:
+    with tracing.span("db.get_issues_for_repo"):
+        conn = get_connection(repo)
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM issues WHERE repo = ?", (repo,))
+        rows = cursor.fetchall()
+        conn.close()
+        return [_row_to_dict(row) for row in rows]
+
+# Analysis filters accepted by the read functions below; missing or empty means "any"
+ISSUE_FILTERS = ("labels", "assignee", "created_after", "created_before", "updated_after", "min_comments", "min_reactions")
+
+def _filter_sql(repo: str, filters: Optional[Dict[str, Any]] = None) -> Tuple[str, List[Any]]:
+    """WHERE clause and parameters selecting a repo's issues that match `filters`."""
+    filters = {key: value for key, value in (filters or {}).items() if value not in (None, [], ())}
+    unknown = set(filters) - set(ISSUE_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown issue filters: {sorted(unknown)}")
+
+    clauses, params = ["repo = ?"], [repo]
+    if "labels" in filters:
+        # Any of the labels
+        labels = list(filters["labels"])
+        clauses.append(f"id IN (SELECT issue_id FROM issue_labels WHERE label IN ({', '.join('?' for _ in labels)}))")
+        params.extend(labels)
+    if "assignee" in filters:
+        clauses.append("id IN (SELECT issue_id FROM issue_assignees WHERE login = ?)")
+        params.append(filters["assignee"])
+    # ISO 8601 timestamps compare correctly as strings, including date-only bounds
+    for key, clause in (
+        ("created_after", "created_at >= ?"),
+        ("created_before", "created_at < ?"),
+        ("updated_after", "updated_at >= ?"),
+        ("min_comments", "comments >= ?"),
+        ("min_reactions", "reactions >= ?"),
+    ):
+        if key in filters:
+            clauses.append(clause)
+            params.append(filters[key])
+    return " AND ".join(clauses), params
+
+@lru_cache(maxsize=None)
+def _row_type(columns: Sequence[str]):
+    """Builds a compact, tuple-backed row class for a column projection."""
+    class IssueRow(namedtuple("IssueRow", columns)):
+        __slots__ = ()
+
+        def get(self, key: str, default: Any = None) -> Any:
+            # Mirrors dict.get so rows can be used wherever issue dicts are expected
+            # Only fields count: tuple methods such as count/index are not issue keys
+            return getattr(self, key) if key in self._fields else default
+
+    return IssueRow
+
+def iter_issues_for_repo(
+    repo: str,
+    columns: Sequence[str] = ISSUE_COLUMNS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    filters: Optional[Dict[str, Any]] = None
+) -> Iterator[Any]:
+    """
+    Streams a repo's issues in id order, reading `batch_size` rows at a time and
+    only the requested columns. Memory stays bounded by the batch, not the repo.
+    `filters` (see ISSUE_FILTERS) are evaluated in SQL.
+
+    Each batch is its own keyset query on a fresh connection, so no read lock is
+    held while the consumer works between batches (e.g. waiting on the LLM) and
+    writers to the same file aren't blocked.
+    """
+    columns = tuple(columns)
+    unknown = set(columns) - set(ISSUE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown issue columns: {sorted(unknown)}")
+
+    row_type = _row_type(columns)
+    body_index = columns.index("body") if "body" in columns else None
+    where, params = _filter_sql(repo, filters)
+    # The id leads every row as the keyset position and is dropped before yielding
+    sql = f"SELECT id, {', '.join(columns)} FROM issues WHERE {where} AND id > ? ORDER BY id LIMIT ?"
+
+    last_id = -(2 ** 63)  # Below any id
+    while True:
+        # Only the fetch is timed; consumers do their own work between batches
+        with tracing.span("db.fetch_batch") as batch_span:
+            conn = get_connection(repo)
+            try:
+                cursor = conn.cursor()
+                cursor.row_factory = None  # Plain tuples; IssueRow wraps them without a dict per row
+                cursor.execute(sql, params + [last_id, batch_size])
+                rows = cursor.fetchall()
+            finally:
+                conn.close()
+            batch_span.set(rows=len(rows))
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        for row in rows:
+            row = row[1:]
+            if body_index is not None:
+                row = row[:body_index] + (_decode_body(row[body_index]),) + row[body_index + 1:]
+            yield row_type(*row)
+        if len(rows) < batch_size:
+            return
+
+def count_issues(repo: str, filters: Optional[Dict[str, Any]] = None) -> int:
+    where, params = _filter_sql(repo, filters)
+    with tracing.span("db.count_issues"):
+        conn = get_connection(repo)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM issues WHERE {where}", params)
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+
+# Stratum of an issue for sampling: its creation month, plus its first label (alphabetically)
+# when it has any, e.g. "2024-03" or "2024-03/bug"
+_STRATUM_SQL = (
+    "IFNULL(substr(created_at, 1, 7), '') || "
+    "IFNULL('/' || (SELECT MIN(label) FROM issue_labels WHERE issue_labels.issue_id = issues.id), '')"
+)
+# Deterministic shuffle (Knuth multiplicative hash of the id), so a repeated sample is identical.
+# The id is reduced to 31 bits first: a larger product overflows SQLite's int64 and turns REAL.
+_SHUFFLE_SQL = "((id % 2147483648) * 2654435761) % 4294967296"
+
+def count_issues_by_stratum(repo: str, filters: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """Issue counts per creation month and first label, the strata used by sample_issues_for_repo."""
+    where, params = _filter_sql(repo, filters)
+    with tracing.span("db.count_strata"):
+        conn = get_connection(repo)
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {_STRATUM_SQL} AS stratum, COUNT(*) FROM issues WHERE {where} GROUP BY stratum",
+            params
+        )
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+        conn.close()
+        return counts
+
+def sample_issues_for_repo(
+    repo: str,
+    quotas: Dict[str, int],
+    columns: Sequence[str] = ISSUE_COLUMNS,
+    filters: Optional[Dict[str, Any]] = None
+) -> List[Any]:
+    """
+    Draws up to `quotas[stratum]` issues from each month/label stratum in one
+    query, in a stable pseudo-random order. Rows come back in id order.
+    """
+    columns = tuple(columns)
+    unknown = set(columns) - set(ISSUE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown issue columns: {sorted(unknown)}")
+    quotas = {stratum: n for stratum, n in quotas.items() if n > 0}
+    if not quotas:
+        return []
+
+    row_type = _row_type(columns)
+    body_index = columns.index("body") if "body" in columns else None
+    values = ", ".join("(?, ?)" for _ in quotas)
+    where, filter_params = _filter_sql(repo, filters)
+    params: List[Any] = [v for item in quotas.items() for v in item] + filter_params
+
+    with tracing.span("db.sample", strata=len(quotas)) as sample_span:
+        conn = get_connection(repo)
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(f"""
+            WITH quota(stratum, n) AS (VALUES {values}),
+            ranked AS (
+                SELECT {', '.join(columns)}, id AS sample_id, {_STRATUM_SQL} AS stratum,
+                       ROW_NUMBER() OVER (PARTITION BY {_STRATUM_SQL} ORDER BY {_SHUFFLE_SQL}) AS rank
+                FROM issues WHERE {where}
+            )
+            SELECT {', '.join(f"ranked.{c}" for c in columns)} FROM ranked
+            JOIN quota ON quota.stratum = ranked.stratum
+            WHERE ranked.rank <= quota.n
+            ORDER BY ranked.sample_id
+        """, params)
+        rows = cursor.fetchall()
+        conn.close()
+        sample_span.set(rows=len(rows))
+
+    if body_index is not None:
+        rows = [row[:body_index] + (_decode_body(row[body_index]),) + row[body_index + 1:] for row in rows]
+    return [row_type(*row) for row in rows]
+
+# Keyset orderings for get_issues_page; id breaks created_at ties
+ISSUE_ORDERINGS = {"id": ("id",), "created_at": ("created_at", "id")}
+# Nullable sort columns order and compare as '' when NULL: a NULL in a row-value
+# comparison matches nothing, which would drop rows from the next page
+_NULLABLE_SORT_COLUMNS = {"created_at"}
+
+def _sort_sql(column: str) -> str:
+    return f"IFNULL({column}, '')" if column in _NULLABLE_SORT_COLUMNS else column
+EXPORT_COLUMNS = ("id", "title", "body", "html_url", "created_at", "updated_at", "comments", "reactions")
+
+def get_issues_page(
+    repo: str,
+    order_by: str = "id",
+    after: Optional[Sequence[Any]] = None,
+    limit: int = 100
+) -> List[Dict[str, Any]]:
+    """
+    One keyset page of a repo's issues with their labels and assignees: the
+    first `limit` issues whose sort key (see ISSUE_ORDERINGS) is greater than
+    `after`. Each call is a short, index-backed query, so paging through a
+    large repo never holds a read transaction open between pages.
+    """
+    if order_by not in ISSUE_ORDERINGS:
+        raise ValueError(f"Unknown ordering: {order_by}")
+    key = ISSUE_ORDERINGS[order_by]
+    clauses, params = ["repo = ?"], [repo]
+    if after is not None:
+        # Cursors come from clients: anything but a list of plain ints/strings is rejected
+        if (
+            not isinstance(after, (list, tuple))
+            or len(after) != len(key)
+            or not all(isinstance(value, (int, str)) and not isinstance(value, bool) for value in after)
+        ):
+            raise ValueError(f"Cursor for {order_by} ordering must be a list of {len(key)} values")
+        clauses.append(f"({', '.join(map(_sort_sql, key))}) > ({', '.join('?' for _ in key)})")
+        params.extend(after)
+
+    with tracing.span("db.issues_page", rows=limit) as page_span:
+        conn = get_connection(repo)
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {', '.join(EXPORT_COLUMNS)} FROM issues WHERE {' AND '.join(clauses)} "
+            f"ORDER BY {', '.join(map(_sort_sql, key))} LIMIT ?",
+            params + [limit]
+        )
+        issues = [_row_to_dict(row) for row in cursor.fetchall()]
+        if issues:
+            by_id = {issue["id"]: issue for issue in issues}
+            for issue in issues:
+                issue["labels"], issue["assignees"] = [], []
+            placeholders = ", ".join("?" for _ in by_id)
+            for table, column, field in (("issue_labels", "label", "labels"), ("issue_assignees", "login", "assignees")):
+                cursor.execute(
+                    f"SELECT issue_id, {column} FROM {table} WHERE issue_id IN ({placeholders}) ORDER BY issue_id, {column}",
+                    list(by_id)
+                )
+                for issue_id, value in cursor.fetchall():
+                    by_id[issue_id][field].append(value)
+        conn.close()
+        page_span.set(rows=len(issues))
+    return issues
+
+def issue_sort_key(issue: Dict[str, Any], order_by: str) -> List[Any]:
+    """The keyset cursor values of an issue returned by get_issues_page."""
+    return [
+        "" if issue[column] is None and column in _NULLABLE_SORT_COLUMNS else issue[column]
+        for column in ISSUE_ORDERINGS[order_by]
+    ]
+
+def backfill_prompt_text(formatter: Callable[[Dict[str, Any]], str], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Fills prompt_text for rows cached before it existed, so analysis never needs to read bodies."""
+    return sum(_backfill_file(path, formatter, batch_size) for path in issue_files())
+
+def _backfill_file(path: str, formatter: Callable[[Dict[str, Any]], str], batch_size: int) -> int:
+    conn = _connect(path)
+    cursor = conn.cursor()
+    updated = 0
+    while True:
+        cursor.execute(
+            "SELECT id, title, body, created_at FROM issues WHERE prompt_text IS NULL LIMIT ?",
+            (batch_size,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            "UPDATE issues SET prompt_text = ? WHERE id = ?",
+            [(formatter(_row_to_dict(row)), row["id"]) for row in rows]
+        )
+        conn.commit()
+        updated += len(rows)
+    conn.close()
+    return updated
+
+def content_fingerprint(rows: Iterable[Any]) -> str:
+    """
+    Hashes (id, prompt_text, updated_at) triples; rows must be in id order.
+    updated_at moves on label, assignee and comment changes, which filtered analyses depend on.
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(f"{row.get('id')}\0{row.get('prompt_text')}\0{row.get('updated_at')}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+def record_scan(repo: str, content_hash: str) -> bool:
+    """
+    Stores a fingerprint of the repo's cached issues; summaries of older content become invalid.
+    Returns True if the content changed since the previous scan.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT content_hash FROM repos WHERE repo = ?", (repo,))
+    row = cursor.fetchone()
+    changed = row is None or row["content_hash"] != content_hash
+    cursor.execute("""
+        INSERT INTO repos (repo, content_hash, last_scanned_at, scan_count, change_count)
+        VALUES (?, ?, ?, 1, 1)
+        ON CONFLICT(repo) DO UPDATE SET
+            content_hash=excluded.content_hash,
+            last_scanned_at=excluded.last_scanned_at,
+            scan_count=scan_count + 1,
+            change_count=change_count + ?
+    """, (repo, content_hash, time.time(), int(changed)))
+    conn.commit()
+    conn.close()
+    return changed
+
+def record_analysis(repo: str):
+    """Counts an analysis of the repo; the refresh scheduler keeps frequently analyzed repos warm."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Repos cached before the repos table existed have no row yet
+    cursor.execute("""
+        INSERT INTO repos (repo, analyze_count, last_analyzed_at) VALUES (?, 1, ?)
+        ON CONFLICT(repo) DO UPDATE SET
+            analyze_count=analyze_count + 1,
+            last_analyzed_at=excluded.last_analyzed_at
+    """, (repo, time.time()))
+    conn.commit()
+    conn.close()
+
+def get_last_scanned_at(repo: str) -> Optional[float]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_scanned_at FROM repos WHERE repo = ?", (repo,))
+    row = cursor.fetchone()
+    conn.close()
+    return row["last_scanned_at"] if row else None
+
+def get_due_repos(now: float, hot_since: float, default_interval: float) -> List[Dict[str, Any]]:
+    """
+    Repos analyzed since `hot_since` whose refresh interval has elapsed, hottest first.
+    Repos never scanned since the repos table was added count as scanned at time 0.
+    """
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM issues WHERE repo = ?", (repo,))
+    cursor.execute("""
+        SELECT repo, COALESCE(refresh_interval, ?) AS refresh_interval, analyze_count
+        FROM repos
+        WHERE last_analyzed_at >= ?
+          AND COALESCE(last_scanned_at, 0) + COALESCE(refresh_interval, ?) <= ?
+        ORDER BY analyze_count DESC, COALESCE(last_scanned_at, 0) ASC
+    """, (default_interval, hot_since, default_interval, now))
     rows = cursor.fetchall()
     conn.close()
     return [dict(row) for row in rows]
 
-def is_repo_scanned(repo: str) -> bool:
+def set_refresh_interval(repo: str, interval: float):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM issues WHERE repo = ? LIMIT 1", (repo,))
-    result = cursor.fetchone()
+    cursor.execute("UPDATE repos SET refresh_interval = ? WHERE repo = ?", (interval, repo))
+    conn.commit()
     conn.close()
-    return result is not None
 
-def get_all_issue_ids(repo: str) -> List[int]:
+def get_repo_content_hash(repo: str) -> Optional[str]:
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id FROM issues WHERE repo = ?", (repo,))
-    rows = cursor.fetchall()
+    cursor.execute("SELECT content_hash FROM repos WHERE repo = ?", (repo,))
+    row = cursor.fetchone()
     conn.close()
-    return [row["id"] for row in rows]
+    return row["content_hash"] if row else None
 
-def delete_issues(ids: List[int]):
-    if not ids:
-        return
+def get_repo_summary(repo: str, prompt_key: str, content_hash: str) -> Optional[str]:
+    """Returns a cached map summary only if it was built from the current content."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT summary FROM repo_summaries WHERE repo = ? AND prompt_key = ? AND content_hash = ?",
+        (repo, prompt_key, content_hash)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row["summary"] if row else None
+
+def save_repo_summary(repo: str, prompt_key: str, content_hash: str, summary: str):
     conn = get_connection()
     cursor = conn.cursor()
-    # sqlite3 supports parameter substitution for checking membership using IN (...)
-    # but the number of placeholders must match.
-    placeholders = ",".join("?" for _ in ids)
-    cursor.execute(f"DELETE FROM issues WHERE id IN ({placeholders})", ids)
+    cursor.execute("""
+        INSERT INTO repo_summaries (repo, prompt_key, content_hash, summary)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(repo, prompt_key) DO UPDATE SET
+            content_hash=excluded.content_hash,
+            summary=excluded.summary
+    """, (repo, prompt_key, content_hash, summary))
     conn.commit()
     conn.close()
+
+def is_repo_scanned(repo: str) -> bool:
+    conn = get_connection(repo)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM issues WHERE repo = ? LIMIT 1", (repo,))
+    result = cursor.fetchone()
+    conn.close()
+    return result is not None
+
+def get_all_issue_ids(repo: str) -> List[int]:
+    with tracing.span("db.get_all_issue_ids"):
+        conn = get_connection(repo)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM issues WHERE repo = ?", (repo,))
+        rows = cursor.fetchall()
+        conn.close()
+        return [row["id"] for row in rows]
+
+def delete_issues(ids: List[int], repo: Optional[str] = None):
+    """Deletes issues by id from `repo`'s shard, or from every file when the repo isn't given."""
+    if not ids:
+        return
+    with tracing.span("db.delete_issues", rows=len(ids)):
+        for path in ([shard_path(repo)] if repo is not None else issue_files()):
+            conn = _connect(path)
+            cursor = conn.cursor()
+            # sqlite3 supports parameter substitution for checking membership using IN (...)
+            # but the number of placeholders must match.
+            placeholders = ",".join("?" for _ in ids)
+            cursor.execute(f"DELETE FROM issues WHERE id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM issue_labels WHERE issue_id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM issue_assignees WHERE issue_id IN ({placeholders})", ids)
+            conn.commit()
+            conn.close()
+
+def _zstd_dict_ids_in_use() -> set:
+    """dict_ids referenced by stored zstd-compressed bodies."""
+    dict_ids = set()
+    for db_path in issue_files():
+        conn = _connect(db_path)
+        for (body,) in conn.execute("SELECT body FROM issues WHERE typeof(body) = 'blob'"):
+            if body.startswith(_ZSTD_MAGIC):
+                dict_ids.add(zstandard.get_frame_parameters(body).dict_id)
+        conn.close()
+    return dict_ids
+
+def train_zstd_dictionary(path: str, dict_size: int = 112640, sample_limit: int = 5000):
+    """
+    Trains a shared zstd dictionary from cached issue bodies, registers it in
+    the catalog and writes it to `path`. Small bodies compress poorly on their
+    own; a dictionary built from typical issue templates recovers most of the
+    redundancy between them. Refuses to overwrite a dictionary file that
+    stored bodies still use; write the new one elsewhere and point
+    ISSUE_BODY_ZSTD_DICT at it.
+    """
+    if zstandard is None:
+        raise RuntimeError("Training a dictionary requires the 'zstandard' package")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            existing_id = zstandard.ZstdCompressionDict(f.read()).dict_id()
+        if existing_id in _zstd_dict_ids_in_use():
+            raise FileExistsError(f"{path} holds zstd dictionary {existing_id}, which cached issue bodies still use")
+
+    samples = []
+    for db_path in issue_files():
+        conn = _connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT body FROM issues WHERE body IS NOT NULL ORDER BY random() LIMIT ?", (sample_limit,))
+        samples.extend(body.encode("utf-8") for body in (_decode_body(row["body"]) for row in cursor.fetchall()) if body)
+        conn.close()
+    samples = samples[:sample_limit]
+
+    dictionary = zstandard.train_dictionary(dict_size, samples)
+    register_zstd_dictionary(dictionary.as_bytes())
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
@@ -1,14 +1,25 @@
+import hashlib
 import os
+import re
 import httpx
 import math
-from typing import List, Dict, Any, Protocol, Optional
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import time
+from itertools import islice
+from typing import List, Dict, Any, Protocol, Optional, Iterable, Iterator, Tuple
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, RetryCallState
+
+import cassette
+import metrics
+import tracing
 
 # --- Provider Interfaces ---
 
 class LLMProvider(Protocol):
-    def generate(self, prompt: str, total_issues: int) -> str:
-        """Generates a text response for the given prompt."""
+    def generate(self, prompt: str, total_issues: int, cache_prefix: str = "") -> str:
+        """
+        Generates a text response for the given prompt. `cache_prefix` is a leading
+        part of `prompt` shared by related calls, which providers may cache.
+        """
         ...
 
     def get_chunk_size(self) -> int:
@@ -19,7 +30,7 @@ class MockLLM:
     def get_chunk_size(self) -> int:
         return 20
 
-    def generate(self, prompt: str, total_issues: int) -> str:
+    def generate(self, prompt: str, total_issues: int, cache_prefix: str = "") -> str:
         """Returns a static mock response for testing/default behavior."""
         limit = 100
         limit = limit if len(prompt) > limit else len(prompt)
@@ -40,10 +51,48 @@ def _is_retryable_error(e: BaseException) -> bool:
         (e.response.status_code == 429 or e.response.status_code >= 500)
     )
 
+def provider_name(client: Any) -> str:
+    """Short provider label for metrics, e.g. OpenAILLM -> openai."""
+    return type(client).__name__.replace("LLM", "").lower()
+
+def model_id(client: Any) -> str:
+    """Provider and model, e.g. ollama/llama3. Outputs of different models aren't interchangeable."""
+    return f"{provider_name(client)}/{getattr(client, 'model', '')}"
+
+def _record_retry(retry_state: RetryCallState):
+    # tenacity before_sleep hook; args[0] is the provider instance
+    metrics.LLM_RETRIES.inc(provider=provider_name(retry_state.args[0]))
+    tracing.increment("retries")
+
+def _raise_for_status(response: httpx.Response, provider: str):
+    if response.status_code == 429:
+        metrics.LLM_RATE_LIMITED.inc(provider=provider)
+        tracing.increment("rate_limited")
+    response.raise_for_status()
+
+def _record_usage(
+    provider: str,
+    usage: Optional[Dict[str, Any]],
+    input_key: str,
+    output_key: str,
+    cache_read_key: Optional[str] = None,
+    cache_write_key: Optional[str] = None
+):
+    if not isinstance(usage, dict):
+        return
+    metrics.LLM_TOKENS.inc(usage.get(input_key) or 0, provider=provider, direction="in")
+    metrics.LLM_TOKENS.inc(usage.get(output_key) or 0, provider=provider, direction="out")
+    # Cache writes are billed at a premium over plain input, reads at a discount
+    if cache_read_key is not None:
+        metrics.LLM_TOKENS.inc(usage.get(cache_read_key) or 0, provider=provider, direction="cache_read")
+    if cache_write_key is not None:
+        metrics.LLM_TOKENS.inc(usage.get(cache_write_key) or 0, provider=provider, direction="cache_write")
+
 class OpenAILLM:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.url = "https://api.openai.com/v1/responses"
+        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+        self.url = f"{base_url}/responses"
         self.model = "gpt-4o-mini"
         self.client = httpx.Client(timeout=30.0)
 
@@ -51,13 +100,15 @@ class OpenAILLM:
         # Keep this conservative for TPM safety
         return 5
 
+    @cassette.recorded("openai", key=lambda self, prompt: (self.url, prompt))
     @retry(
         stop=stop_after_attempt(2),
         wait=wait_exponential(multiplier=1, min=2, max=16),
         retry=retry_if_exception_type(httpx.HTTPStatusError),
+        before_sleep=_record_retry,
         reraise=True
     )
-    def _call_api(self, prompt: str) -> str:
+    def _call_api(self, prompt: str) -> Dict[str, Any]:
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -74,12 +125,9 @@ class OpenAILLM:
                 headers=headers,
                 json=data
             )
-            response.raise_for_status()
+            _raise_for_status(response, "openai")
 
-            result = response.json()
-
-            # Responses API convenience field
-            return result["output_text"]
+            return response.json()
 
         except httpx.HTTPStatusError as e:
             status = e.response.status_code
@@ -93,10 +141,15 @@ class OpenAILLM:
             # Re-raise so tenacity can retry
             raise
 
-    def generate(self, prompt: str, total_issues: int) -> str:
+    def generate(self, prompt: str, total_issues: int, cache_prefix: str = "") -> str:
+        # OpenAI caches repeated prompt prefixes automatically
         try:
             print("Generating response...")
-            return self._call_api(prompt)
+            result = self._call_api(prompt)
+            # Recorded outside the cassette so replayed calls are counted too
+            _record_usage("openai", result.get("usage"), "input_tokens", "output_tokens")
+            # Responses API convenience field
+            return result["output_text"]
         except Exception as e:
             return f"Error calling OpenAI: {str(e)}"
 
@@ -107,37 +160,55 @@ class OpenAILLM:
 class AnthropicLLM:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.url = "https://api.anthropic.com/v1/messages"
+        base_url = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+        self.url = f"{base_url}/v1/messages"
         self.model = "claude-3-haiku-20240307" # Fast, cost-effective model
+        # Shortest prefix the model will cache (2048 tokens for Haiku, 1024 for larger models)
+        self.cache_min_tokens = int(os.getenv("ANTHROPIC_CACHE_MIN_TOKENS", "2048"))
 
     def get_chunk_size(self) -> int:
         return 100  # Anthropic models have large context windows
 
+    @cassette.recorded("anthropic", key=lambda self, prompt, cache_prefix="": (self.url, prompt))
     @retry(
         stop=stop_after_attempt(2),
         wait=wait_exponential(multiplier=1, min=2, max=16),
         retry=retry_if_exception_type(httpx.HTTPStatusError),
+        before_sleep=_record_retry,
         reraise=True
     )
-    def _call_api(self, prompt: str) -> Dict[str, Any]:
+    def _call_api(self, prompt: str, cache_prefix: str = "") -> Dict[str, Any]:
         headers = {
             "x-api-key": self.api_key,
             "anthropic-version": "2023-06-01",
             "Content-Type": "application/json"
         }
+        content: Any = prompt
+        # A breakpoint on a shorter prefix is ignored by the API, so only long prefixes get one
+        # (about 4 characters per token)
+        cacheable = len(cache_prefix) // 4 >= self.cache_min_tokens
+        if cacheable and len(prompt) > len(cache_prefix) and prompt.startswith(cache_prefix):
+            content = [
+                {"type": "text", "text": cache_prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt[len(cache_prefix):]},
+            ]
         data = {
             "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": [{"role": "user", "content": content}],
             "max_tokens": 1000
         }
         with httpx.Client(timeout=30.0) as client:
             response = client.post(self.url, headers=headers, json=data)
-            response.raise_for_status()
+            _raise_for_status(response, "anthropic")
             return response.json()
 
-    def generate(self, prompt: str, total_issues: int) -> str:
+    def generate(self, prompt: str, total_issues: int, cache_prefix: str = "") -> str:
         try:
-            result = self._call_api(prompt)
+            result = self._call_api(prompt, cache_prefix)
+            _record_usage(
+                "anthropic", result.get("usage"), "input_tokens", "output_tokens",
+                cache_read_key="cache_read_input_tokens", cache_write_key="cache_creation_input_tokens"
+            )
             return result["content"][0]["text"]
         except Exception as e:
             return f"Error calling Anthropic: {str(e)}"
@@ -146,15 +217,19 @@ class GeminiLLM:
     def __init__(self, api_key: str):
         self.api_key = api_key
         # using gemini-1.5-flash which is fast and free-tier eligible
-        self.url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+        self.model = "gemini-2.0-flash"
+        base_url = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+        self.url = f"{base_url}/v1beta/models/{self.model}:generateContent"
 
     def get_chunk_size(self) -> int:
         return 200  # Gemini 1.5 has a very large context window
 
+    @cassette.recorded("gemini", key=lambda self, prompt: (self.url, prompt))
     @retry(
         stop=stop_after_attempt(2),
         wait=wait_exponential(multiplier=1, min=2, max=16),
         retry=retry_if_exception_type(httpx.HTTPStatusError),
+        before_sleep=_record_retry,
         reraise=True
     )
     def _call_api(self, prompt: str) -> Dict[str, Any]:
@@ -167,12 +242,13 @@ class GeminiLLM:
         }
         with httpx.Client(timeout=30.0) as client:
             response = client.post(self.url, params=params, headers=headers, json=data)
-            response.raise_for_status()
+            _raise_for_status(response, "gemini")
             return response.json()
 
-    def generate(self, prompt: str, total_issues: int) -> str:
+    def generate(self, prompt: str, total_issues: int, cache_prefix: str = "") -> str:
         try:
             result = self._call_api(prompt)
+            _record_usage("gemini", result.get("usageMetadata"), "promptTokenCount", "candidatesTokenCount")
             # Parse safety settings or empty responses safely
             if "candidates" not in result or not result["candidates"]:
                 return "Error: No candidates returned from Gemini (possible safety block)."
@@ -194,10 +270,12 @@ class OllamaLLM:
     def get_chunk_size(self) -> int:
         return 50  # Conservative default for local models
 
+    @cassette.recorded("ollama", key=lambda self, prompt: (self.base_url, prompt))
     @retry(
         stop=stop_after_attempt(2),
         wait=wait_exponential(multiplier=1, min=2, max=16),
         retry=retry_if_exception_type(httpx.HTTPStatusError),
+        before_sleep=_record_retry,
         reraise=True
     )
     def _call_api(self, prompt: str) -> Dict[str, Any]:
@@ -213,14 +291,15 @@ class OllamaLLM:
 
         with httpx.Client(timeout=60.0) as client:
             response = client.post(self.base_url, headers=headers, json=data)
-            response.raise_for_status()
+            _raise_for_status(response, "ollama")
             return response.json()
 
-    def generate(self, prompt: str, total_issues: int) -> str:
+    def generate(self, prompt: str, total_issues: int, cache_prefix: str = "") -> str:
         try:
             print(f"prompt: {prompt}\n")
             result = self._call_api(prompt)
             print(f"result: {result}\n")
+            _record_usage("ollama", result.get("usage"), "prompt_tokens", "completion_tokens")
             return result["choices"][0]["message"]["content"]
         except Exception as e:
             return f"Error calling Ollama: {str(e)}"
@@ -250,71 +329,249 @@ def get_llm_client() -> LLMProvider:
 
 
 
+MAX_BODY_CHARS = int(os.getenv("MAX_ISSUE_BODY_CHARS", "1500"))
+FOLD_KEEP_LINES = 3  # Lines kept from each end of a folded code/log block
+
+_HTML_COMMENT_RE = re.compile(r"<!--.*?(?:-->|\Z)", re.DOTALL)
+_FENCED_BLOCK_RE = re.compile(r"^(```|~~~)[^\n]*\n(.*?)(?:^\1[ \t]*$|\Z)", re.DOTALL | re.MULTILINE)
+_CHECKBOX_RE = re.compile(r"^\s*[-*]\s+\[[ xX]\].*$", re.MULTILINE)
+_NO_RESPONSE_RE = re.compile(r"^\s*_No response_\s*$", re.MULTILINE)
+_EMPTY_HEADING_RE = re.compile(r"^#{1,6}\s[^\n]*\n+(?=#{1,6}\s|\Z)", re.MULTILINE)
+_LIST_ITEM_RE = re.compile(r"^([-*+]|\d+[.)])\s")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+def _fold_lines(lines: List[str]) -> str:
+    """Keeps the head and tail of a long block; the tail usually holds the actual error."""
+    # Only fold when the marker replaces more than one line
+    if len(lines) <= 2 * FOLD_KEEP_LINES + 1:
+        return "\n".join(lines)
+    omitted = len(lines) - 2 * FOLD_KEEP_LINES
+    return "\n".join(
+        lines[:FOLD_KEEP_LINES]
+        + [f"[... {omitted} lines folded ...]"]
+        + lines[-FOLD_KEEP_LINES:]
+    )
+
+def _fold_indented_blocks(text: str) -> str:
+    """
+    Folds runs of indented lines (stack frames, pasted logs) outside code fences.
+    Nested list items are kept, but a long indented paragraph under a list item
+    is still folded like a log.
+    """
+    out, run = [], []
+    for line in text.split("\n"):
+        if line.startswith(("    ", "\t")) and not _LIST_ITEM_RE.match(line.lstrip()):
+            run.append(line.strip())
+            continue
+        if run:
+            out.append(_fold_lines(run))
+            run = []
+        out.append(line)
+    if run:
+        out.append(_fold_lines(run))
+    return "\n".join(out)
+
+def normalize_body(body: Optional[str], max_chars: int = MAX_BODY_CHARS) -> str:
+    """
+    Compresses a raw issue body into prompt-ready text:
+    strips template boilerplate (HTML comments, checklists, empty sections),
+    folds code blocks and logs, collapses whitespace and caps the length.
+    """
+    if not body:
+        return ""
+
+    text = body.replace("\r\n", "\n")
+    text = _HTML_COMMENT_RE.sub("", text)
+    text = _FENCED_BLOCK_RE.sub(
+        lambda m: _fold_lines([l for l in m.group(2).strip("\n").split("\n") if l.strip()]),
+        text,
+    )
+    text = _fold_indented_blocks(text)
+    text = _CHECKBOX_RE.sub("", text)
+    text = _NO_RESPONSE_RE.sub("", text)
+    text = _BLANK_LINES_RE.sub("\n", text).strip()
+    text = _EMPTY_HEADING_RE.sub("", text + "\n").strip()
+
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + " [truncated]"
+    return text
+
 def format_issue(issue: Dict[str, Any]) -> str:
     """Formats a single issue for the prompt."""
-    return f"- #{issue.get('id')} {issue.get('title')} (Created: {issue.get('created_at')})\n  Body: {issue.get('body') or 'No description'}...\n"
+    body = normalize_body(issue.get('body')) or 'No description'
+    return f"- #{issue.get('id')} {issue.get('title')} (Created: {issue.get('created_at')})\n  Body: {body}...\n"
+
+def issue_prompt_text(issue: Dict[str, Any]) -> str:
+    """Returns the prompt text precomputed at scan time, formatting on the fly for older rows."""
+    return issue.get('prompt_text') or format_issue(issue)
+
+def format_chunk(chunk: List[Any]) -> str:
+    """Joins a chunk's prompt texts, counting precomputed-text hits once per chunk."""
+    with tracing.span("llm.format_chunk", issues=len(chunk)):
+        hits = sum(1 for issue in chunk if issue.get('prompt_text'))
+        metrics.CACHE_LOOKUPS.inc(hits, cache="prompt_text", result="hit")
+        metrics.CACHE_LOOKUPS.inc(len(chunk) - hits, cache="prompt_text", result="miss")
+        return "\n".join([issue_prompt_text(issue) for issue in chunk])
+
+def analysis_prefix(prompt: str) -> str:
+    """
+    Leading text shared by every direct, map and reduce call for a user prompt.
+    Stage-specific instructions and data follow it, so providers can reuse the
+    cached prefix across all calls of one analysis.
+    """
+    return (
+        "System: You are a senior software triage assistant analyzing GitHub issues. "
+        "Answer the user prompt from the issues or issue summaries provided below.\n"
+        f"User Prompt: {prompt}\n"
+    )
 
-def generate_analysis(prompt: str, issues: List[Dict[str, Any]]) -> str:
+MAP_TASK = (
+    "Task: Summarize this batch of issues as it relates to the user prompt. "
+    "Focus on themes, bugs, and feature requests.\n"
+)
+
+# Changes whenever the map prompt template does, so cached map summaries from an older template expire
+MAP_PROMPT_VERSION = hashlib.sha256(
+    (analysis_prefix("{prompt}") + MAP_TASK + "Issues:\n{issues}").encode("utf-8")
+).hexdigest()[:12]
+
+def timed_generate(client: LLMProvider, prompt: str, total_issues: int, stage: str, cache_prefix: str = "") -> str:
+    """Calls the provider, recording latency and in-flight calls."""
+    provider = provider_name(client)
+    with metrics.LLM_IN_FLIGHT.track_inprogress(provider=provider):
+        with metrics.LLM_REQUEST_SECONDS.time(provider=provider, stage=stage), tracing.span(f"llm.{stage}", provider=provider):
+            return client.generate(prompt, total_issues, cache_prefix=cache_prefix)
+
+def iter_chunks(issues: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    """Yields successive chunks without materializing the whole iterable."""
+    iterator = iter(issues)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def generate_analysis(prompt: str, issues: Iterable[Any], total_issues: Optional[int] = None) -> str:
     """
     Orchestrates the analysis:
     1. Checks if chunking is needed.
     2. Runs map-reduce if issues > CHUNK_SIZE.
     3. Calls the selected LLM provider.
+
+    `issues` may be a lazy iterable (e.g. database.iter_issues_for_repo) when
+    `total_issues` is given; it is then consumed one chunk at a time.
+    """
+    return generate_analysis_with_coverage(prompt, issues, total_issues)[0]
+
+def generate_analysis_with_coverage(
+    prompt: str,
+    issues: Iterable[Any],
+    total_issues: Optional[int] = None,
+    deadline: Optional[float] = None
+) -> Tuple[str, int]:
+    """
+    Like generate_analysis, but bounded by an optional `deadline` (a time.monotonic()
+    timestamp) and returning the analysis with the number of issues it covers.
     """
     client = get_llm_client()
     chunk_size = client.get_chunk_size()
-    
+
+    if total_issues is None:
+        issues = list(issues)
+        total_issues = len(issues)
+
     # Safety fallback for empty list
-    if not issues:
-        return "No issues provided for analysis."
+    if not total_issues:
+        return "No issues provided for analysis.", 0
 
-    total_issues = len(issues)
-    
     # Direct pass if small enough
     if total_issues <= chunk_size:
-        context = "\n".join([format_issue(i) for i in issues])
+        context = format_chunk(list(issues))
+        prefix = analysis_prefix(prompt)
         full_prompt = (
-            "System: You are a senior software triage assistant."
-            "Synthesize issue summaries into a coherent, prioritized analysis.\n"
-            f"User Prompt: {prompt}\n"
-            f"Issues Context:{context}\n"
-            "Provide a clear, actionable final analysis."
+            f"{prefix}"
+            "Task: Provide a clear, actionable, prioritized analysis of these issues.\n"
+            f"Issues:\n{context}"
         )
-        return client.generate(full_prompt, total_issues)
+        return timed_generate(client, full_prompt, total_issues, "direct", prefix), total_issues
 
     # Map-Reduce for large sets
-    # 1. Map: Analyze chunks
+    chunk_summaries = map_issue_chunks(client, prompt, issues, total_issues, deadline)
+    covered = issues_covered(chunk_summaries, chunk_size, total_issues)
+    return reduce_summaries(client, prompt, chunk_summaries, total_issues, covered), covered
+
+def issues_covered(chunk_summaries: List[str], chunk_size: int, total_issues: int) -> int:
+    """Issues covered by the map summaries; chunks are summarized in order, so only the tail can be missing."""
+    return min(total_issues, len(chunk_summaries) * chunk_size)
+
+def map_issue_chunks(
+    client: LLMProvider,
+    prompt: str,
+    issues: Iterable[Any],
+    total_issues: int,
+    deadline: Optional[float] = None
+) -> List[str]:
+    """
+    Map phase: summarizes each chunk of issues against the user prompt.
+
+    With a `deadline` (a time.monotonic() timestamp), stops dispatching chunks once
+    the time left would not fit another call plus the reduce, each estimated as
+    the slowest map call so far. The first chunk is always summarized.
+    """
+    chunk_size = client.get_chunk_size()
+    prefix = analysis_prefix(prompt)
     chunk_summaries = []
     num_chunks = math.ceil(total_issues / chunk_size)
+    slowest_call = 0.0
     
-    for i in range(num_chunks):
-        chunk = issues[i * chunk_size : (i + 1) * chunk_size]
-        chunk_context = "\n".join([format_issue(iss) for iss in chunk])
-        if (i > 0):
-            chunk_prompt = (
-                f"Summarize these GitHub issues relevant to this request: '{prompt}'.\n"
-                f"Focus on themes, bugs, and feature requests.\n"
-                f"Issues:{chunk_context}\n"
-            )
-        else:
-            chunk_prompt = (
-                "System: You are a senior software triage assistant."
-                "Synthesize issue summaries into a coherent, prioritized analysis.\n"
-                f"User Prompt: '{prompt}'"
-                f"Focus on themes, bugs, and feature requests."
-                f"Issues:\n{chunk_context}"
-            )
+    for i, chunk in enumerate(iter_chunks(issues, chunk_size)):
+        if deadline is not None and i > 0 and time.monotonic() + 2 * slowest_call > deadline:
+            tracing.annotate(deadline_stopped_at_chunk=i + 1)
+            break
+
+        # Identical for every chunk up to the issues, so the prefix is cached after the first call
+        chunk_prompt = (
+            f"{prefix}"
+            f"{MAP_TASK}"
+            f"Issues:\n{format_chunk(chunk)}"
+        )
         
         # We process chunks sequentially here (could be parallelized with async, but keeping it simple/safe)
-        summary = client.generate(chunk_prompt, total_issues)
+        started = time.monotonic()
+        summary = timed_generate(client, chunk_prompt, total_issues, "map", prefix)
+        slowest_call = max(slowest_call, time.monotonic() - started)
         chunk_summaries.append(f"Chunk {i+1}/{num_chunks} Summary:\n{summary}")
 
-    # 2. Reduce: Final synthesis
-    combined_summaries = "\n\n".join(chunk_summaries)
+    return chunk_summaries
+
+def reduce_summaries(
+    client: LLMProvider,
+    prompt: str,
+    summaries: List[str],
+    total_issues: int,
+    covered_issues: Optional[int] = None
+) -> str:
+    """Reduce phase: synthesizes intermediate summaries into the final answer."""
+    combined_summaries = "\n\n".join(summaries)
+    coverage_note = ""
+    if covered_issues is not None and covered_issues < total_issues:
+        coverage_note = f"Note: these summaries cover only {covered_issues} of {total_issues} issues; say so in the answer.\n"
+    prefix = analysis_prefix(prompt)
     final_prompt = (
-        f"You are providing a final analysis of GitHub issues based on summaries of issue batches.\n"
-        f"User Prompt: {prompt}\n"
-        f"Intermediate Summaries:\n{combined_summaries}\n"
-        f"Synthesize these summaries into a cohesive answer addressing the user prompt."
-    )    
-    return client.generate(final_prompt, total_issues)
+        f"{prefix}"
+        "Task: Synthesize these summaries of issue batches into a cohesive answer addressing the user prompt.\n"
+        f"{coverage_note}"
+        f"Intermediate Summaries:\n{combined_summaries}"
+    )
+    return timed_generate(client, final_prompt, total_issues, "reduce", prefix)
+
+def generate_cross_repo_analysis(
+    client: LLMProvider,
+    prompt: str,
+    repo_summaries: Dict[str, str],
+    total_issues: int,
+    covered_issues: Optional[int] = None
+) -> str:
+    """Single reduce step over per-repo map summaries."""
+    summaries = [f"Repository {repo}:\n{summary}" for repo, summary in repo_summaries.items()]
+    return reduce_summaries(client, prompt, summaries, total_issues, covered_issues)
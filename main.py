@@ -1,8 +1,25 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from schemas import ScanRequest, ScanResponse, AnalyzeRequest, AnalyzeResponse
-from clients import GitHubClient
-from llm_client import generate_analysis
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from schemas import ScanRequest, ScanResponse, ScanBatchRequest, ScanBatchResult, AnalyzeRequest, AnalyzeResponse, IssuePage, IssueOrdering
+from clients import GitHubClient, RateLimitExhausted
+from scheduler import RefreshScheduler
+from llm_client import generate_analysis_with_coverage, generate_cross_repo_analysis, map_issue_chunks, issues_covered, get_llm_client, format_issue, model_id, LLMProvider, MAP_PROMPT_VERSION
+import async_db
 import database
+import metrics
+import sampling
+import tracing
 
 from dotenv import load_dotenv
 
@@ -14,71 +31,375 @@ load_dotenv()
 async def lifespan(app: FastAPI):
     # Startup logic
     database.init_db()
+    database.backfill_prompt_text(format_issue)
+    if REFRESH_ENABLED:
+        refresh_scheduler.start()
     yield
-    # Shutdown logic (if any) would go here
+    # Shutdown logic
+    await refresh_scheduler.stop()
+    await async_db.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 github_client = GitHubClient()
 # LLM Client is now functional via generate_analysis
 
+# Analysis only needs the precomputed prompt text, never the raw body
+ANALYSIS_COLUMNS = ("id", "title", "created_at", "prompt_text")
 
+# Max repos scanned at once by /scan/batch
+SCAN_BATCH_CONCURRENCY = int(os.getenv("SCAN_BATCH_CONCURRENCY", "10"))
+# Max repos whose map phase runs at once in a cross-repo /analyze
+ANALYZE_REPO_CONCURRENCY = int(os.getenv("ANALYZE_REPO_CONCURRENCY", "8"))
+# Background re-scans of frequently analyzed repos (see scheduler.RefreshScheduler)
+REFRESH_ENABLED = os.getenv("REFRESH_ENABLED", "false").lower() in ("1", "true", "yes")
+# Overlap for incremental refreshes, covering issues updated while the previous scan ran
+REFRESH_SINCE_SKEW_SECONDS = 300
+# Rows read per query by the NDJSON issue export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
 
-def prune_stale_issues(repo: str, fresh_issue_ids: set[int]):
-    print(f"Starting prune for {repo}...")
-    cached_ids = set(database.get_all_issue_ids(repo))
-    stale_ids = list(cached_ids - fresh_issue_ids)
-    
-    if stale_ids:
-        print(f"Pruning {len(stale_ids)} stale issues for {repo}")
-        database.delete_issues(stale_ids)
-    else:
-        print(f"No stale issues to prune for {repo}")
 
-@app.post("/scan", response_model=ScanResponse)
-async def scan_repo(request: ScanRequest, background_tasks: BackgroundTasks):
-    try:
-        issues = await github_client.fetch_open_issues(request.repo)
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Error fetching issues: {str(e)}")
 
-    count = 0
-    fresh_ids = set()
+async def prune_stale_issues(repo: str, fresh_issue_ids: set[int]):
+    print(f"Starting prune for {repo}...")
+    with metrics.DB_PRUNE_SECONDS.time(), tracing.span("db.prune", repo=repo):
+        cached_ids = set(await async_db.read(database.get_all_issue_ids, repo))
+        stale_ids = list(cached_ids - fresh_issue_ids)
+        
+        if stale_ids:
+            print(f"Pruning {len(stale_ids)} stale issues for {repo}")
+            await async_db.write(database.delete_issues, stale_ids, repo)
+        else:
+            print(f"No stale issues to prune for {repo}")
+
+def build_issue_rows(repo: str, issues: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = []
     for issue in issues:
         # Extract required fields
         issue_data = {
             "id": issue["id"],
-            "repo": request.repo,
+            "repo": repo,
             "title": issue["title"],
             "body": issue.get("body"), # body can be None
             "html_url": issue["html_url"],
-            "created_at": issue["created_at"]
+            "created_at": issue["created_at"],
+            "updated_at": issue.get("updated_at"),
+            "comments": issue.get("comments") or 0,
+            "reactions": (issue.get("reactions") or {}).get("total_count", 0),
+            "labels": [label["name"] if isinstance(label, dict) else label for label in issue.get("labels") or []],
+            "assignees": [assignee["login"] for assignee in issue.get("assignees") or []],
         }
-        database.upsert_issue(issue_data)
-        fresh_ids.add(issue["id"])
-        count += 1
+        # Normalize once at scan time so /analyze can read prompt-ready text directly
+        issue_data["prompt_text"] = format_issue(issue_data)
+        rows.append(issue_data)
+    return rows
+
+async def cache_issues(repo: str, issues: List[Dict[str, Any]]) -> set[int]:
+    """Upserts fetched issues and returns their ids for pruning."""
+    rows = build_issue_rows(repo, issues)
+    await async_db.write(database.upsert_issues, rows)
+
+    # Fingerprint of what the cache holds after this scan (prune removes everything else),
+    # so cached per-repo summaries are reused only while the issues are unchanged
+    await async_db.write(database.record_scan, repo, database.content_fingerprint(sorted(rows, key=lambda r: r["id"])))
+
+    return {row["id"] for row in rows}
+
+async def refresh_repo(repo: str) -> bool:
+    """
+    Incrementally re-scans a cached repo: only issues updated since the last scan
+    are fetched, open ones are upserted and closed ones removed.
+    Returns True if the cached issues changed.
+    """
+    last_scanned_at = await async_db.read(database.get_last_scanned_at, repo) or 0
+    since = datetime.fromtimestamp(max(0, last_scanned_at - REFRESH_SINCE_SKEW_SECONDS), tz=timezone.utc)
+    items = await github_client.fetch_issues_since(repo, since.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+    open_issues = [item for item in items if item.get("state", "open") == "open"]
+    closed_ids = [item["id"] for item in items if item.get("state") == "closed"]
+    await async_db.write(database.upsert_issues, build_issue_rows(repo, open_issues))
+    await async_db.write(database.delete_issues, closed_ids, repo)
+
+    fingerprint = await async_db.read(
+        lambda: database.content_fingerprint(database.iter_issues_for_repo(repo, columns=("id", "prompt_text", "updated_at")))
+    )
+    return await async_db.write(database.record_scan, repo, fingerprint)
+
+refresh_scheduler = RefreshScheduler(github_client, refresh_repo)
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/scan", response_model=ScanResponse)
+async def scan_repo(request: ScanRequest, background_tasks: BackgroundTasks):
+    with metrics.SCAN_IN_PROGRESS.track_inprogress(), tracing.span("scan", repo=request.repo):
+        try:
+            issues = await github_client.fetch_open_issues(request.repo)
+        except RateLimitExhausted as e:
+            # Not a missing repo: tell the client when to come back
+            raise HTTPException(status_code=429, detail=f"Error fetching issues: {str(e)}", headers={"Retry-After": str(e.retry_after())})
+        except Exception as e:
+            raise HTTPException(status_code=404, detail=f"Error fetching issues: {str(e)}")
+
+        fresh_ids = await cache_issues(request.repo, issues)
     
     background_tasks.add_task(prune_stale_issues, request.repo, fresh_ids)
     
     return ScanResponse(
         repo=request.repo,
-        issues_fetched=count,
+        issues_fetched=len(fresh_ids),
         cached_successfully=True
     )
 
+@app.post("/scan/batch")
+async def scan_repos_batch(request: ScanBatchRequest):
+    """
+    Scans many repos concurrently and streams one NDJSON result line per repo
+    as each finishes. All scans share one connection pool and the GitHub
+    client's per-host limits and rate-limit budget.
+    """
+    repos = list(dict.fromkeys(request.repos))  # De-duplicate, keep order
+
+    async def scan_one(http: httpx.AsyncClient, semaphore: asyncio.Semaphore, repo: str) -> ScanBatchResult:
+        async with semaphore:
+            with metrics.SCAN_IN_PROGRESS.track_inprogress(), tracing.span("scan", repo=repo):
+                try:
+                    issues = await github_client.fetch_open_issues(repo, client=http)
+                except RateLimitExhausted as e:
+                    return ScanBatchResult(
+                        repo=repo, issues_fetched=0, cached_successfully=False,
+                        error=f"Error fetching issues: {str(e)}", retry_after=e.retry_after()
+                    )
+                except Exception as e:
+                    return ScanBatchResult(repo=repo, issues_fetched=0, cached_successfully=False, error=f"Error fetching issues: {str(e)}")
+
+                try:
+                    fresh_ids = await cache_issues(repo, issues)
+                    await prune_stale_issues(repo, fresh_ids)
+                except Exception as e:
+                    # Report it on this repo's line instead of cutting off the whole stream
+                    return ScanBatchResult(repo=repo, issues_fetched=len(issues), cached_successfully=False, error=f"Error caching issues: {str(e)}")
+                return ScanBatchResult(repo=repo, issues_fetched=len(fresh_ids), cached_successfully=True)
+
+    async def stream_results():
+        semaphore = asyncio.Semaphore(SCAN_BATCH_CONCURRENCY)
+        limits = httpx.Limits(max_connections=github_client.per_host_concurrency)
+        async with httpx.AsyncClient(follow_redirects=True, limits=limits) as http:
+            tasks = [asyncio.create_task(scan_one(http, semaphore, repo)) for repo in repos]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    yield result.model_dump_json() + "\n"
+            finally:
+                # Client went away mid-stream: don't leave scans running against a closed pool
+                for task in tasks:
+                    task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List[Any]]:
+    if cursor is None:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _require_scanned(repo: str):
+    if not database.is_repo_scanned(repo):
+        raise HTTPException(status_code=404, detail="Repo not scanned. Please scan first.")
+
+def _issues_page(repo: str, order_by: str, after: Optional[List[Any]], limit: int) -> List[Dict[str, Any]]:
+    try:
+        return database.get_issues_page(repo, order_by, after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/repos/{owner}/{repo}/issues", response_model=IssuePage)
+def list_issues(
+    owner: str,
+    repo: str,
+    order_by: IssueOrdering = "id",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Keyset-paginated cached issues, in `order_by` order; follow `next_cursor` for the next page."""
+    full_name = f"{owner}/{repo}"
+    _require_scanned(full_name)
+    issues = _issues_page(full_name, order_by, decode_cursor(cursor), limit)
+    next_cursor = encode_cursor(database.issue_sort_key(issues[-1], order_by)) if len(issues) == limit else None
+    return IssuePage(repo=full_name, issues=issues, next_cursor=next_cursor)
+
+@app.get("/repos/{owner}/{repo}/issues/export")
+def export_issues(owner: str, repo: str, order_by: IssueOrdering = "id", cursor: Optional[str] = None):
+    """
+    Streams every cached issue as NDJSON, optionally resuming after `cursor`.
+    Rows are read one keyset page at a time on a worker thread, so memory stays
+    constant and no read transaction is held while the client consumes the stream.
+    """
+    full_name = f"{owner}/{repo}"
+    _require_scanned(full_name)
+    after = decode_cursor(cursor)
+    first_page = _issues_page(full_name, order_by, after, EXPORT_BATCH_SIZE)
+
+    def stream_lines(page: List[Dict[str, Any]]):
+        while page:
+            yield "".join(json.dumps(issue) + "\n" for issue in page)
+            if len(page) < EXPORT_BATCH_SIZE:
+                return
+            page = database.get_issues_page(full_name, order_by, database.issue_sort_key(page[-1], order_by), EXPORT_BATCH_SIZE)
+
+    # A sync generator is iterated in Starlette's thread pool, off the event loop
+    return StreamingResponse(stream_lines(first_page), media_type="application/x-ndjson")
+
+def summarize_repo(
+    client: LLMProvider,
+    prompt: str,
+    repo: str,
+    deadline: Optional[float] = None,
+    filters: Optional[Dict[str, Any]] = None
+) -> Tuple[str, int]:
+    """
+    Map phase for one repo, reusing the cached summary while the repo's issues are unchanged.
+    Returns the summary and the number of issues it covers.
+    """
+    with tracing.span("summarize_repo", repo=repo):
+        return _summarize_repo(client, prompt, repo, deadline, filters)
+
+def _summarize_repo(
+    client: LLMProvider,
+    prompt: str,
+    repo: str,
+    deadline: Optional[float],
+    filters: Optional[Dict[str, Any]]
+) -> Tuple[str, int]:
+    # Filters select different issues, so they are part of the cache key; so are the
+    # model and the map prompt template, which shape the summary
+    filter_key = json.dumps(filters or {}, sort_keys=True)
+    prompt_key = hashlib.sha256(
+        f"{model_id(client)}\0{MAP_PROMPT_VERSION}\0{prompt}\0{filter_key}".encode("utf-8")
+    ).hexdigest()
+    content_hash = database.get_repo_content_hash(repo)
+    total_issues = database.count_issues(repo, filters)
+    if content_hash:
+        cached = database.get_repo_summary(repo, prompt_key, content_hash)
+        if cached is not None:
+            metrics.CACHE_LOOKUPS.inc(cache="repo_summary", result="hit")
+            return cached, total_issues
+    metrics.CACHE_LOOKUPS.inc(cache="repo_summary", result="miss")
+
+    issues = database.iter_issues_for_repo(repo, columns=ANALYSIS_COLUMNS, filters=filters)
+    chunk_summaries = map_issue_chunks(client, prompt, issues, total_issues, deadline)
+    summary = "\n\n".join(chunk_summaries)
+    covered = issues_covered(chunk_summaries, client.get_chunk_size(), total_issues)
+
+    # A summary cut short by a deadline is not reusable
+    if content_hash and covered == total_issues:
+        database.save_repo_summary(repo, prompt_key, content_hash, summary)
+    return summary, covered
+
+def analyze_repos(
+    prompt: str,
+    repos: List[str],
+    deadline: Optional[float] = None,
+    filters: Optional[Dict[str, Any]] = None
+) -> Tuple[str, int, int]:
+    """
+    Cross-repo analysis: per-repo map phases run in parallel, then one reduce over all of them.
+    Returns the analysis, the issues it covers and the total issues across repos.
+    """
+    client = get_llm_client()
+    with ThreadPoolExecutor(max_workers=min(ANALYZE_REPO_CONCURRENCY, len(repos))) as pool:
+        results = list(pool.map(tracing.wrap(lambda repo: summarize_repo(client, prompt, repo, deadline, filters)), repos))
+
+    summaries = {repo: summary for repo, (summary, _) in zip(repos, results)}
+    covered = sum(repo_covered for _, repo_covered in results)
+    total_issues = sum(database.count_issues(repo, filters) for repo in repos)
+    return generate_cross_repo_analysis(client, prompt, summaries, total_issues, covered), covered, total_issues
+
+def coverage_response(analysis: str, covered: int, total_issues: int, sampled: Optional[int] = None) -> AnalyzeResponse:
+    """`sampled` is the sample size for sampled analyses; `covered` is how much of it the deadline allowed."""
+    analyzed = total_issues if sampled is None else sampled
+    partial = covered < analyzed
+    if partial:
+        metrics.ANALYZE_PARTIAL.inc()
+    coverage = round(covered / total_issues, 4) if total_issues else 1.0
+    sampling_ratio = round(sampled / total_issues, 4) if sampled is not None and total_issues else None
+    return AnalyzeResponse(analysis=analysis, coverage=coverage, partial=partial, sampling_ratio=sampling_ratio)
+
+def sample_issues(
+    repo: str,
+    total_issues: int,
+    sample_size: Optional[int],
+    confidence: Optional[float],
+    filters: Optional[Dict[str, Any]] = None
+) -> List[Any]:
+    """Stratified sample of a repo's (matching) issues by creation month and label, sized by count or confidence level."""
+    target = sampling.target_sample_size(total_issues, sample_size, confidence)
+    quotas = sampling.allocate(database.count_issues_by_stratum(repo, filters), target)
+    return database.sample_issues_for_repo(repo, quotas, columns=ANALYSIS_COLUMNS, filters=filters)
+
 @app.post("/analyze", response_model=AnalyzeResponse)
-def analyze_repo(request: AnalyzeRequest):
+def analyze_repo(request: AnalyzeRequest, response: Response, x_debug_timing: Optional[str] = Header(default=None)):
+    with metrics.ANALYZE_IN_PROGRESS.track_inprogress():
+        with tracing.span("analyze", repos=request.target_repos()) as root:
+            result = _analyze(request)
+
+    # Opt-in per-stage breakdown, via the `debug` field or an X-Debug-Timing header
+    if request.debug or x_debug_timing:
+        result.timings = root.breakdown()
+        response.headers["Server-Timing"] = root.server_timing()
+    return result
+
+def _analyze(request: AnalyzeRequest) -> AnalyzeResponse:
+    repos = request.target_repos()
+    filters = request.issue_filters()
+    # Counted from arrival, so database time is part of the budget
+    deadline = time.monotonic() + request.deadline_ms / 1000 if request.deadline_ms else None
+
     # Validate scan
-    if not database.is_repo_scanned(request.repo):
-        return AnalyzeResponse(analysis="Repo not scanned. Please scan first.")
+    unscanned = [repo for repo in repos if not database.is_repo_scanned(repo)]
+    if unscanned:
+        if len(repos) == 1:
+            return AnalyzeResponse(analysis="Repo not scanned. Please scan first.")
+        return AnalyzeResponse(analysis=f"Repos not scanned: {', '.join(unscanned)}. Please scan first.")
 
-    issues = database.get_issues_for_repo(request.repo)
-    
-    if not issues:
+    for repo in repos:
+        database.record_analysis(repo)
+
+    if len(repos) > 1:
+        try:
+            analysis, covered, total_issues = analyze_repos(request.prompt, repos, deadline, filters)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"LLM Error: {str(e)}")
+        return coverage_response(analysis, covered, total_issues)
+
+    repo = repos[0]
+    # Filters are evaluated in SQL, so only matching issues are read and sent to the LLM
+    total_issues = database.count_issues(repo, filters)
+
+    if not total_issues:
+        if filters:
+            return AnalyzeResponse(analysis="No issues in this repo match the filters.")
         return AnalyzeResponse(analysis="No issues found for this repo.")
 
+    if request.is_sampled():
+        # Bounded by the sample size, so LLM cost no longer grows with the repo
+        issues = sample_issues(repo, total_issues, request.sample_size, request.confidence, filters)
+        sampled: Optional[int] = len(issues)
+    else:
+        # Streamed lazily so memory is bounded by the chunk size, not the repo size
+        issues = database.iter_issues_for_repo(repo, columns=ANALYSIS_COLUMNS, filters=filters)
+        sampled = None
+
     try:
-        analysis = generate_analysis(request.prompt, issues)
+        analysis, covered = generate_analysis_with_coverage(
+            request.prompt, issues, total_issues=len(issues) if sampled is not None else total_issues, deadline=deadline
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM Error: {str(e)}")
         
-    return AnalyzeResponse(analysis=analysis)
+    return coverage_response(analysis, covered, total_issues, sampled)
@@ -0,0 +1,169 @@
+"""
+Minimal, dependency-free Prometheus metrics.
+
+Counters, gauges and histograms keep plain numbers behind one lock per metric,
+so recording is a dict lookup and an addition, cheap enough to leave on in
+production. `render()` produces the Prometheus text exposition format for the
+/metrics endpoint.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_registry: List["_Metric"] = []
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> Iterator[str]:
+        """Yields one exposition line per sample."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels: str):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (last one is +Inf), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+# --- Application metrics ---
+
+# /scan
+GITHUB_PAGE_SECONDS = Histogram("github_page_seconds", "Latency of one GitHub issues page request.", ["status"])
+GITHUB_PAGES_PER_SCAN = Histogram("github_pages_per_scan", "GitHub pages fetched per repo scan.", buckets=COUNT_BUCKETS)
+SCAN_IN_PROGRESS = Gauge("scan_repos_in_progress", "Repo scans currently fetching or writing.")
+
+# database
+DB_UPSERT_BATCH_SECONDS = Histogram("db_upsert_batch_seconds", "Time to upsert one batch of issues.")
+DB_PRUNE_SECONDS = Histogram("db_prune_seconds", "Time to prune stale issues for a repo.")
+DB_WRITE_QUEUE_DEPTH = Gauge("db_write_queue_depth", "Writes queued for the database writer thread.")
+DB_WRITE_BATCH_JOBS = Histogram("db_write_batch_jobs", "Queued writes executed per writer-thread transaction.", buckets=COUNT_BUCKETS)
+
+# /analyze
+ANALYZE_IN_PROGRESS = Gauge("analyze_requests_in_progress", "Analyses currently running.")
+ANALYZE_PARTIAL = Counter("analyze_partial_total", "Analyses answered from a partial map phase because of their deadline.")
+LLM_REQUEST_SECONDS = Histogram("llm_request_seconds", "Latency of one LLM call, including retries.", ["provider", "stage"])
+LLM_IN_FLIGHT = Gauge("llm_requests_in_flight", "LLM calls waiting on a provider.", ["provider"])
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a retryable error.", ["provider"])
+LLM_RATE_LIMITED = Counter("llm_rate_limited_total", "LLM responses with HTTP 429.", ["provider"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the provider.", ["provider", "direction"])
+CACHE_LOOKUPS = Counter("analysis_cache_lookups_total", "Analysis cache lookups by cache and result.", ["cache", "result"])
@@ -0,0 +1,46 @@
+"""
+Sample sizing and stratified allocation for sampled /analyze requests.
+
+A sample is either a fixed size or sized for a confidence level: Cochran's
+formula at the worst-case proportion (p = 0.5) with SAMPLE_MARGIN_OF_ERROR,
+corrected for the finite repo size. The sample is then split across strata
+(creation months) in proportion to their size.
+"""
+import math
+import os
+from statistics import NormalDist
+from typing import Dict, Optional
+
+MARGIN_OF_ERROR = float(os.getenv("SAMPLE_MARGIN_OF_ERROR", "0.05"))
+
+def sample_size_for_confidence(population: int, confidence: float, margin_of_error: float = MARGIN_OF_ERROR) -> int:
+    """Issues needed so a proportion estimated from the sample is within the margin at this confidence."""
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    n0 = z * z * 0.25 / (margin_of_error * margin_of_error)
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+def target_sample_size(population: int, sample_size: Optional[int] = None, confidence: Optional[float] = None) -> int:
+    """The requested sample size, capped at the population; the whole population if neither is given."""
+    if sample_size is not None:
+        return min(population, sample_size)
+    if confidence is not None:
+        return sample_size_for_confidence(population, confidence)
+    return population
+
+def allocate(strata: Dict[str, int], sample_size: int) -> Dict[str, int]:
+    """
+    Proportional allocation by largest remainder: quotas sum to `sample_size`
+    (capped at the population) and never exceed a stratum's size.
+    """
+    population = sum(strata.values())
+    if sample_size >= population:
+        return dict(strata)
+
+    exact = {stratum: size * sample_size / population for stratum, size in strata.items()}
+    quotas = {stratum: int(share) for stratum, share in exact.items()}
+    leftover = sample_size - sum(quotas.values())
+    # Ties go to the earlier stratum, so allocation is deterministic
+    by_remainder = sorted(exact, key=lambda stratum: (quotas[stratum] - exact[stratum], stratum))
+    for stratum in by_remainder[:leftover]:
+        quotas[stratum] += 1
+    return quotas
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple
+
+from clients import GitHubClient, RequestBudgetExhausted, metered_requests
+import async_db
+import database
+
+class RefreshScheduler:
+    """
+    Keeps frequently analyzed repos warm by re-scanning them in the background.
+
+    Only repos analyzed within REFRESH_HOT_WINDOW are refreshed, hottest first.
+    Each repo's interval adapts to how often its issues change: it halves after
+    a refresh that found changes and grows by half after one that didn't,
+    bounded by REFRESH_MIN_INTERVAL and REFRESH_MAX_INTERVAL. Refreshes stop
+    for the hour once REFRESH_GITHUB_BUDGET of their own requests have been
+    spent (a refresh stops paging mid-repo if it would overshoot), and
+    whenever GitHub reports fewer than REFRESH_RATE_LIMIT_RESERVE requests
+    left, so interactive scans keep their share of the quota.
+    """
+
+    def __init__(self, github_client: GitHubClient, refresh: Callable[[str], Awaitable[bool]]):
+        # `refresh` re-scans one repo and returns True if its cached issues changed
+        self.github_client = github_client
+        self.refresh = refresh
+        self.tick_seconds = float(os.getenv("REFRESH_TICK_SECONDS", "60"))
+        self.hot_window = float(os.getenv("REFRESH_HOT_WINDOW", str(3 * 24 * 3600)))
+        self.default_interval = float(os.getenv("REFRESH_DEFAULT_INTERVAL", "3600"))
+        self.min_interval = float(os.getenv("REFRESH_MIN_INTERVAL", "300"))
+        self.max_interval = float(os.getenv("REFRESH_MAX_INTERVAL", str(24 * 3600)))
+        self.budget_per_hour = int(os.getenv("REFRESH_GITHUB_BUDGET", "500"))
+        self.rate_limit_reserve = int(os.getenv("REFRESH_RATE_LIMIT_RESERVE", "100"))
+        self._spent: Deque[Tuple[float, int]] = deque()  # (timestamp, requests) in the last hour
+        self._retry_at: Dict[str, float] = {}  # Failed repos wait out their interval before retrying
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def budget_left(self, now: float) -> int:
+        while self._spent and self._spent[0][0] <= now - 3600:
+            self._spent.popleft()
+        return self.budget_per_hour - sum(requests for _, requests in self._spent)
+
+    def _quota_available(self, now: float) -> bool:
+        remaining = self.github_client.rate_limit_remaining
+        if remaining is not None and remaining < self.rate_limit_reserve:
+            return False
+        return self.budget_left(now) > 0
+
+    def next_interval(self, interval: float, changed: bool) -> float:
+        interval = interval / 2 if changed else interval * 1.5
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    async def run_once(self) -> List[str]:
+        """Refreshes every due repo the quota allows; returns the repos refreshed."""
+        now = time.time()
+        refreshed = []
+        due_repos = await async_db.read(database.get_due_repos, now, now - self.hot_window, self.default_interval)
+        for due in due_repos:
+            if not self._quota_available(time.time()):
+                print("Refresh budget exhausted, deferring remaining repos")
+                break
+
+            repo = due["repo"]
+            if self._retry_at.get(repo, 0) > now:
+                continue
+
+            # Only this refresh's own requests are charged, and paging stops once the budget is spent
+            with metered_requests(self.budget_left(time.time())) as meter:
+                try:
+                    changed = await self.refresh(repo)
+                    refreshed.append(repo)
+                    self._retry_at.pop(repo, None)
+                except RequestBudgetExhausted:
+                    # Nothing was recorded for the partial refresh; the repo stays due
+                    self._spent.append((time.time(), meter.count))
+                    print(f"Refresh budget exhausted during {repo}, deferring remaining repos")
+                    break
+                except Exception as e:
+                    # Back off like an unchanged repo so a failing repo doesn't retry every tick
+                    print(f"Background refresh failed for {repo}: {e}")
+                    changed = False
+            self._spent.append((time.time(), meter.count))
+
+            interval = self.next_interval(due["refresh_interval"], changed)
+            await async_db.write(database.set_refresh_interval, repo, interval)
+            if repo not in refreshed:
+                self._retry_at[repo] = now + interval
+
+        return refreshed
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Refresh scheduler error: {e}")
+            await asyncio.sleep(self.tick_seconds)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, model_validator
+from typing import Any, Dict, Optional, List, Literal
 
 class ScanRequest(BaseModel):
     repo: str
@@ -9,9 +9,88 @@ class ScanResponse(BaseModel):
     issues_fetched: int
     cached_successfully: bool
 
+class ScanBatchRequest(BaseModel):
+    repos: List[str]
+
+class ScanBatchResult(ScanResponse):
+    error: Optional[str] = None
+    retry_after: Optional[int] = None  # Seconds until GitHub's rate limit resets, when that was the error
+
 class AnalyzeRequest(BaseModel):
-    repo: str
+    repo: Optional[str] = None
+    repos: List[str] = []  # Cross-repo analysis over several repos at once
     prompt: str
+    debug: bool = False  # Include a per-stage timing breakdown in the response
+    deadline_ms: Optional[int] = None  # Time budget; on expiry, answer from the chunks summarized so far
+    sample_size: Optional[int] = None  # Analyze a stratified sample of this many issues
+    confidence: Optional[float] = None  # Or size the sample for this confidence level, e.g. 0.95
+    # Filters, evaluated in SQL before chunking; dates are ISO 8601
+    labels: List[str] = []  # Issues with any of these labels
+    assignee: Optional[str] = None
+    created_after: Optional[str] = None
+    created_before: Optional[str] = None
+    updated_after: Optional[str] = None
+    min_comments: Optional[int] = None
+    min_reactions: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_repos(self):
+        if not self.repo and not self.repos:
+            raise ValueError("Provide 'repo' or 'repos'")
+        if self.deadline_ms is not None and self.deadline_ms <= 0:
+            raise ValueError("'deadline_ms' must be positive")
+        if self.sample_size is not None and self.confidence is not None:
+            raise ValueError("Provide 'sample_size' or 'confidence', not both")
+        if self.sample_size is not None and self.sample_size <= 0:
+            raise ValueError("'sample_size' must be positive")
+        if self.confidence is not None and not 0 < self.confidence < 1:
+            raise ValueError("'confidence' must be between 0 and 1")
+        if self.is_sampled() and len(self.target_repos()) > 1:
+            raise ValueError("Sampling is only supported for a single repo")
+        return self
+
+    def issue_filters(self) -> Dict[str, Any]:
+        """The filters that were set, keyed as database.ISSUE_FILTERS."""
+        filters = {
+            "labels": self.labels,
+            "assignee": self.assignee,
+            "created_after": self.created_after,
+            "created_before": self.created_before,
+            "updated_after": self.updated_after,
+            "min_comments": self.min_comments,
+            "min_reactions": self.min_reactions,
+        }
+        return {key: value for key, value in filters.items() if value not in (None, [])}
+
+    def is_sampled(self) -> bool:
+        return self.sample_size is not None or self.confidence is not None
+
+    def target_repos(self) -> List[str]:
+        """All requested repos, de-duplicated in request order."""
+        return list(dict.fromkeys(([self.repo] if self.repo else []) + self.repos))
 
 class AnalyzeResponse(BaseModel):
     analysis: str
+    coverage: Optional[float] = None  # Fraction of the repo's issues the analysis is based on
+    partial: bool = False  # True when the deadline cut the map phase short
+    sampling_ratio: Optional[float] = None  # Fraction of the repo's issues in the sample, for sampled analyses
+    timings: Optional[Dict[str, Any]] = None
+
+class IssueRecord(BaseModel):
+    id: int
+    title: Optional[str] = None
+    body: Optional[str] = None
+    html_url: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    comments: int = 0
+    reactions: int = 0
+    labels: List[str] = []
+    assignees: List[str] = []
+
+IssueOrdering = Literal["id", "created_at"]
+
+class IssuePage(BaseModel):
+    repo: str
+    issues: List[IssueRecord]
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page; null on the last page
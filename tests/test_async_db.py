@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+import pytest
+import async_db
+import database
+
+@pytest.fixture(autouse=True)
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "issues.db"))
+    database.init_db()
+
+def _issue(i, repo="r1"):
+    return {"id": i, "repo": repo, "title": f"t{i}", "html_url": "u", "created_at": "d"}
+
+def _blocking_write(release: threading.Event):
+    # Holds the writer thread so later writes queue up behind it
+    release.wait(5)
+
+@pytest.mark.asyncio
+async def test_write_then_read():
+    await async_db.write(database.upsert_issues, [_issue(1), _issue(2)])
+    assert sorted(await async_db.read(database.get_all_issue_ids, "r1")) == [1, 2]
+    assert await async_db.read(database.count_issues, "r1", {"min_comments": 0}) == 2
+
+@pytest.mark.asyncio
+async def test_queued_upserts_coalesce_into_one_transaction(monkeypatch):
+    calls = []
+    real_upsert = database.upsert_issues
+    monkeypatch.setattr(database, "upsert_issues", lambda rows: (calls.append(len(rows)), real_upsert(rows)))
+
+    release = threading.Event()
+    blocker = asyncio.create_task(async_db.write(_blocking_write, release))
+    writes = [asyncio.create_task(async_db.write(database.upsert_issues, [_issue(i)])) for i in range(5)]
+    await asyncio.sleep(0.05)
+    release.set()
+    await asyncio.gather(blocker, *writes)
+
+    assert calls == [5]
+    assert await async_db.read(database.count_issues, "r1") == 5
+
+@pytest.mark.asyncio
+async def test_bad_row_fails_only_its_own_write():
+    release = threading.Event()
+    blocker = asyncio.create_task(async_db.write(_blocking_write, release))
+    good = asyncio.create_task(async_db.write(database.upsert_issues, [_issue(1)]))
+    bad = asyncio.create_task(async_db.write(database.upsert_issues, [{"id": 2, "repo": "r1"}]))
+    await asyncio.sleep(0.05)
+    release.set()
+
+    await asyncio.gather(blocker, good)
+    with pytest.raises(KeyError):
+        await bad
+    assert await async_db.read(database.get_all_issue_ids, "r1") == [1]
+
+@pytest.mark.asyncio
+async def test_slow_write_does_not_block_event_loop():
+    write = asyncio.create_task(async_db.write(time.sleep, 0.3))
+    started = time.perf_counter()
+    await asyncio.sleep(0.01)
+    assert time.perf_counter() - started < 0.2
+    await write
+
+@pytest.mark.asyncio
+async def test_shutdown_flushes_queued_writes():
+    write = asyncio.create_task(async_db.write(database.upsert_issues, [_issue(7)]))
+    await asyncio.sleep(0)
+    await async_db.shutdown()
+    await write
+    assert database.get_all_issue_ids("r1") == [7]
@@ -0,0 +1,60 @@
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+import clients
+from clients import GitHubClient
+from llm_client import AnthropicLLM, GeminiLLM, OllamaLLM, OpenAILLM
+from benchmarks import fake_github, fake_llm
+
+# The fakes must stay wire-compatible with the real clients, or benchmarks measure nothing
+
+@pytest.mark.asyncio
+async def test_fake_github_paginates_for_github_client():
+    transport = httpx.ASGITransport(app=fake_github.app)
+    with patch.object(clients, "GITHUB_API_URL", "http://fake-github"):
+        async with httpx.AsyncClient(transport=transport) as http:
+            github = GitHubClient()
+            issues = await github.fetch_open_issues("bench/issues-250", client=http)
+
+    assert len(issues) == 225  # Every tenth item is a pull request
+    assert github.requests_made == 3
+    assert github.rate_limit_remaining is not None
+
+@pytest.mark.asyncio
+async def test_fake_github_since_returns_suffix():
+    transport = httpx.ASGITransport(app=fake_github.app)
+    since = fake_github.make_item("bench", "issues-250", 200)["updated_at"]
+    with patch.object(clients, "GITHUB_API_URL", "http://fake-github"):
+        async with httpx.AsyncClient(transport=transport) as http:
+            issues = await GitHubClient().fetch_issues_since("bench/issues-250", since, client=http)
+
+    assert [i["number"] for i in issues][:2] == [201, 202]
+    assert len(issues) == 45
+
+@pytest.mark.parametrize("provider_cls,env", [
+    (OpenAILLM, {"OPENAI_BASE_URL": "http://fake-llm/v1"}),
+    (AnthropicLLM, {"ANTHROPIC_BASE_URL": "http://fake-llm"}),
+    (GeminiLLM, {"GEMINI_BASE_URL": "http://fake-llm"}),
+])
+def test_fake_llm_speaks_provider_formats(provider_cls, env, monkeypatch):
+    monkeypatch.setattr(fake_llm, "LATENCY_MS", 0)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+
+    with patch("httpx.Client", return_value=TestClient(fake_llm.app, base_url="http://fake-llm")):
+        llm = provider_cls("key")
+        assert llm.generate("prompt", 1) == fake_llm.OUTPUT_TEXT
+
+def test_fake_llm_ollama_format(monkeypatch):
+    monkeypatch.setattr(fake_llm, "LATENCY_MS", 0)
+    llm = OllamaLLM("http://fake-llm/v1", "bench")
+    with patch("httpx.Client", return_value=TestClient(fake_llm.app, base_url="http://fake-llm")):
+        assert llm.generate("prompt", 1) == fake_llm.OUTPUT_TEXT
+
+def test_fake_llm_throttles(monkeypatch):
+    monkeypatch.setattr(fake_llm, "RATE_429", 1.0)
+    response = TestClient(fake_llm.app).post("/v1/messages", json={"messages": [{"role": "user", "content": "hi"}]})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
@@ -0,0 +1,109 @@
+import time
+import pytest
+import httpx
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import cassette
+from clients import GitHubClient
+import metrics
+from llm_client import AnthropicLLM, OpenAILLM
+
+@pytest.fixture
+def cassette_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(cassette, "CASSETTE_FILE", str(tmp_path / "cassettes.db"))
+    monkeypatch.setattr(cassette, "LATENCY_SCALE", 1.0)
+    return lambda mode: monkeypatch.setattr(cassette, "MODE", mode)
+
+def test_off_mode_passes_through(cassette_mode):
+    cassette_mode("off")
+    calls = []
+
+    @cassette.recorded("test", key=lambda x: x)
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    assert double(2) == 4
+    assert double(2) == 4
+    assert calls == [2, 2]
+
+def test_record_then_replay_with_latency(cassette_mode):
+    calls = []
+
+    @cassette.recorded("test", key=lambda x: {"x": x})
+    def slow_double(x):
+        calls.append(x)
+        time.sleep(0.05)
+        return {"value": x * 2}
+
+    cassette_mode("record")
+    assert slow_double(3) == {"value": 6}
+
+    cassette_mode("replay")
+    start = time.perf_counter()
+    assert slow_double(3) == {"value": 6}
+    assert time.perf_counter() - start >= 0.04
+    assert calls == [3]
+
+    with pytest.raises(cassette.CassetteMiss):
+        slow_double(4)
+
+def test_anthropic_call_replays_offline(cassette_mode):
+    client = AnthropicLLM("key")
+    payload = {"content": [{"text": "Recorded answer"}], "usage": {"input_tokens": 3, "output_tokens": 2}}
+
+    cassette_mode("record")
+    with patch("httpx.Client") as mock_client_cls:
+        response = MagicMock(status_code=200)
+        response.json.return_value = payload
+        mock_client_cls.return_value.__enter__.return_value.post.return_value = response
+        assert client.generate("prompt", 1) == "Recorded answer"
+
+    cassette_mode("replay")
+    with patch("httpx.Client") as mock_client_cls:
+        assert client.generate("prompt", 1) == "Recorded answer"
+        mock_client_cls.assert_not_called()
+        # An unrecorded prompt misses and surfaces as the provider's error string
+        assert "Error calling Anthropic" in client.generate("other prompt", 1)
+
+def test_openai_replay_records_token_usage(cassette_mode):
+    client = OpenAILLM("key")
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"output_text": "Recorded answer", "usage": {"input_tokens": 7, "output_tokens": 4}}
+    client.client = MagicMock()
+    client.client.post.return_value = response
+
+    cassette_mode("record")
+    assert client.generate("prompt", 1) == "Recorded answer"
+
+    cassette_mode("replay")
+    client.client.post.reset_mock()
+    before = metrics.LLM_TOKENS.value(provider="openai", direction="in")
+    assert client.generate("prompt", 1) == "Recorded answer"
+    client.client.post.assert_not_called()
+    assert metrics.LLM_TOKENS.value(provider="openai", direction="in") - before == 7
+
+@pytest.mark.asyncio
+async def test_github_pages_replay_offline(cassette_mode):
+    client = GitHubClient()
+    request = httpx.Request("GET", "https://api.github.com/repos/owner/repo/issues")
+    pages = [
+        httpx.Response(200, json=[{"id": 1}, {"id": 2, "pull_request": {}}], headers={"link": '<url>; rel="next"'}, request=request),
+        httpx.Response(200, json=[{"id": 3}], request=request),
+    ]
+
+    cassette_mode("record")
+    with patch("httpx.AsyncClient") as mock_client_cls:
+        mock_client = AsyncMock()
+        mock_client_cls.return_value.__aenter__.return_value = mock_client
+        mock_client.get.side_effect = pages
+        recorded = await client.fetch_open_issues("owner/repo")
+
+    cassette_mode("replay")
+    with patch("httpx.AsyncClient") as mock_client_cls:
+        mock_client = AsyncMock()
+        mock_client_cls.return_value.__aenter__.return_value = mock_client
+        replayed = await client.fetch_open_issues("owner/repo")
+        mock_client.get.assert_not_called()
+
+    assert [issue["id"] for issue in replayed] == [issue["id"] for issue in recorded] == [1, 3]
@@ -1,12 +1,15 @@
 
+import json
+import time
 import pytest
 from unittest.mock import AsyncMock, patch
-from clients import GitHubClient
+from clients import GitHubClient, RateLimitExhausted
 
 class MockResponse:
     def __init__(self, status_code, json_data, headers=None):
         self.status_code = status_code
         self._json_data = json_data
+        self.content = json.dumps(json_data).encode("utf-8")
         self.headers = headers or {}
 
     def json(self):
@@ -77,3 +80,38 @@ async def test_fetch_open_issues_empty():
         issues = await client.fetch_open_issues("owner/empty")
         assert len(issues) == 0
 
+@pytest.mark.asyncio
+async def test_fetch_open_issues_tracks_rate_limit():
+    client = GitHubClient()
+
+    with patch("httpx.AsyncClient") as mock_client_cls:
+        mock_client = AsyncMock()
+        mock_client_cls.return_value.__aenter__.return_value = mock_client
+
+        r1 = MockResponse(200, [{"id": 1}], {
+            "link": '<url>; rel="next"',
+            "x-ratelimit-remaining": "0",
+            "x-ratelimit-reset": str(time.time() + 600)
+        })
+        mock_client.get.return_value = r1
+
+        # Budget is spent after the first page, so the scan stops instead of hammering the API
+        with pytest.raises(RateLimitExhausted) as exc_info:
+            await client.fetch_open_issues("owner/repo")
+        assert 590 <= exc_info.value.retry_after() <= 600
+
+        assert client.rate_limit_remaining == 0
+        assert client.rate_limit_exhausted()
+        assert mock_client.get.call_count == 1
+
+@pytest.mark.asyncio
+async def test_fetch_open_issues_shared_client():
+    client = GitHubClient()
+    shared = AsyncMock()
+    shared.get.return_value = MockResponse(200, [{"id": 1}])
+
+    with patch("httpx.AsyncClient") as mock_client_cls:
+        issues = await client.fetch_open_issues("owner/repo", client=shared)
+        mock_client_cls.assert_not_called()
+
+    assert len(issues) == 1
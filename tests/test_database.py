@@ -101,3 +101,324 @@ def test_delete_issues():
 def test_delete_issues_empty():
     database.delete_issues([])
     # Should not error
+
+def test_upsert_issue_stores_prompt_text():
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "t1", "html_url": "u", "created_at": "d", "prompt_text": "- #1 t1"})
+    issues = database.get_issues_for_repo("r1")
+    assert issues[0]["prompt_text"] == "- #1 t1"
+
+def test_init_db_migrates_old_schema():
+    os.remove(TEST_DB)
+    conn = sqlite3.connect(TEST_DB)
+    conn.execute("CREATE TABLE issues (id INTEGER PRIMARY KEY, repo TEXT NOT NULL, title TEXT, body TEXT, html_url TEXT, created_at TEXT)")
+    conn.commit()
+    conn.close()
+
+    database.init_db()
+
+    conn = sqlite3.connect(TEST_DB)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(issues)")}
+    conn.close()
+    assert "prompt_text" in columns
+
+def test_body_compression_roundtrip(monkeypatch):
+    monkeypatch.setattr(database, "BODY_COMPRESSION", "zlib")
+    body = "Steps to reproduce\n" * 50
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "t1", "body": body, "html_url": "u", "created_at": "d"})
+
+    conn = sqlite3.connect(TEST_DB)
+    stored = conn.execute("SELECT body FROM issues WHERE id = 1").fetchone()[0]
+    conn.close()
+    assert isinstance(stored, bytes)
+    assert len(stored) < len(body)
+
+    issues = database.get_issues_for_repo("r1")
+    assert issues[0]["body"] == body
+
+def test_body_compression_mixed_rows(monkeypatch):
+    # Rows written before compression was enabled remain readable
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "t1", "body": "plain " * 20, "html_url": "u", "created_at": "d"})
+    monkeypatch.setattr(database, "BODY_COMPRESSION", "zlib")
+    database.upsert_issue({"id": 2, "repo": "r1", "title": "t2", "body": "packed " * 20, "html_url": "u", "created_at": "d"})
+    # Short bodies that don't shrink are kept as text
+    database.upsert_issue({"id": 3, "repo": "r1", "title": "t3", "body": "x", "html_url": "u", "created_at": "d"})
+
+    bodies = {i["id"]: i["body"] for i in database.get_issues_for_repo("r1")}
+    assert bodies == {1: "plain " * 20, 2: "packed " * 20, 3: "x"}
+
+def test_body_compression_zstd(monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(database, "BODY_COMPRESSION", "zstd")
+    body = "Traceback (most recent call last):\n" * 30
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "t1", "body": body, "html_url": "u", "created_at": "d"})
+    assert database.get_issues_for_repo("r1")[0]["body"] == body
+
+def test_zstd_bodies_survive_dictionary_changes(tmp_path, monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(database, "BODY_COMPRESSION", "zstd")
+    monkeypatch.setattr(database, "_zstd_compression_dicts", {})
+    monkeypatch.setattr(database, "_zstd_dicts", {})
+
+    def body(i):
+        return f"### Describe the bug\nCrash {i} in module {i % 7}\n### Steps to reproduce\nRun command {i * 13}\n" * 3
+    database.upsert_issues([
+        {"id": i, "repo": "r1", "title": "t", "body": body(i), "html_url": "u", "created_at": "d"} for i in range(300)
+    ])
+
+    first = str(tmp_path / "first.dict")
+    database.train_zstd_dictionary(first, dict_size=4096)
+    monkeypatch.setattr(database, "ZSTD_DICT_FILE", first)
+    database.upsert_issue({"id": 1000, "repo": "r1", "title": "t", "body": body(1000), "html_url": "u", "created_at": "d"})
+
+    # The file is in use, so retraining must go elsewhere
+    with pytest.raises(FileExistsError):
+        database.train_zstd_dictionary(first, dict_size=4096)
+    second = str(tmp_path / "second.dict")
+    database.train_zstd_dictionary(second, dict_size=4096)
+    monkeypatch.setattr(database, "ZSTD_DICT_FILE", second)
+    database.upsert_issue({"id": 1001, "repo": "r1", "title": "t", "body": body(1001), "html_url": "u", "created_at": "d"})
+
+    conn = sqlite3.connect(TEST_DB)
+    frames = [conn.execute("SELECT body FROM issues WHERE id = ?", (i,)).fetchone()[0] for i in (1000, 1001)]
+    conn.close()
+    dict_ids = {database.zstandard.get_frame_parameters(frame).dict_id for frame in frames}
+    assert len(dict_ids) == 2 and 0 not in dict_ids
+
+    # Readable via the catalog with the setting removed and the files gone
+    monkeypatch.setattr(database, "ZSTD_DICT_FILE", None)
+    monkeypatch.setattr(database, "_zstd_dicts", {})
+    os.remove(first)
+    os.remove(second)
+    bodies = {i["id"]: i["body"] for i in database.get_issues_for_repo("r1")}
+    assert bodies[1000] == body(1000) and bodies[1001] == body(1001)
+
+def test_iter_issues_for_repo_projection():
+    for i in range(5):
+        database.upsert_issue({"id": i, "repo": "r1", "title": f"t{i}", "body": "b", "html_url": "u", "created_at": "d"})
+    database.upsert_issue({"id": 99, "repo": "r2", "title": "other", "html_url": "u", "created_at": "d"})
+
+    rows = list(database.iter_issues_for_repo("r1", columns=("id", "title"), batch_size=2))
+    assert [r.id for r in rows] == [0, 1, 2, 3, 4]
+    assert rows[0].get("title") == "t0"
+    assert rows[0].get("body") is None  # Not projected
+    assert rows[0].get("count") is None and rows[0].get("index", "dflt") == "dflt"
+    assert not hasattr(rows[0], "__dict__")
+
+def test_write_while_iterator_suspended():
+    for i in range(4):
+        database.upsert_issue({"id": i, "repo": "r1", "title": f"t{i}", "html_url": "u", "created_at": "d"})
+
+    rows = database.iter_issues_for_repo("r1", columns=("id",), batch_size=2)
+    assert next(rows).id == 0
+    # No read lock is held between batches, so the write doesn't wait for the busy timeout
+    conn = sqlite3.connect(TEST_DB, timeout=0)
+    conn.execute("INSERT INTO issues (id, repo, title, html_url, created_at) VALUES (10, 'r1', 't', 'u', 'd')")
+    conn.commit()
+    conn.close()
+    database.upsert_issues([{"id": 11, "repo": "r1", "title": "t11", "html_url": "u", "created_at": "d"}])
+
+    assert [r.id for r in rows] == [1, 2, 3, 10, 11]
+
+def test_iter_issues_for_repo_unknown_column():
+    with pytest.raises(ValueError):
+        list(database.iter_issues_for_repo("r1", columns=("id", "secret")))
+
+def test_count_issues():
+    assert database.count_issues("r1") == 0
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "t1", "html_url": "u", "created_at": "d"})
+    assert database.count_issues("r1") == 1
+
+def test_sample_issues_for_repo_by_month():
+    database.upsert_issues(
+        [{"id": i, "repo": "r1", "title": f"jan{i}", "html_url": "u", "created_at": f"2024-01-{i + 1:02d}T00:00:00Z"} for i in range(6)]
+        + [{"id": 100 + i, "repo": "r1", "title": f"feb{i}", "html_url": "u", "created_at": f"2024-02-{i + 1:02d}T00:00:00Z"} for i in range(3)]
+    )
+    assert database.count_issues_by_stratum("r1") == {"2024-01": 6, "2024-02": 3}
+
+    rows = database.sample_issues_for_repo("r1", {"2024-01": 2, "2024-02": 1}, columns=("title",))
+    titles = [r.title for r in rows]
+    assert sum(t.startswith("jan") for t in titles) == 2
+    assert sum(t.startswith("feb") for t in titles) == 1
+    # Same quotas, same sample
+    assert [r.title for r in database.sample_issues_for_repo("r1", {"2024-01": 2, "2024-02": 1}, columns=("title",))] == titles
+    assert database.sample_issues_for_repo("r1", {}) == []
+
+def test_sample_label_strata_get_their_quota():
+    from sampling import allocate
+    database.upsert_issues(
+        [{"id": i, "repo": "r1", "title": "plain", "html_url": "u", "created_at": "2024-01-01T00:00:00Z"} for i in range(40)]
+        + [{"id": 100 + i, "repo": "r1", "title": "security", "html_url": "u", "created_at": "2024-01-01T00:00:00Z",
+            "labels": ["security", "triage"]} for i in range(5)]
+    )
+    strata = database.count_issues_by_stratum("r1")
+    assert strata == {"2024-01": 40, "2024-01/security": 5}
+
+    quotas = allocate(strata, 9)
+    rows = database.sample_issues_for_repo("r1", quotas, columns=("title",))
+    assert sum(r.title == "security" for r in rows) == quotas["2024-01/security"] == 1
+    assert len(rows) == 9
+
+def test_sample_shuffle_with_large_ids():
+    # GitHub issue ids are approaching the range where id * 2654435761 overflows int64
+    base = 4_000_000_000
+    database.upsert_issues([
+        {"id": base + i, "repo": "r1", "title": f"t{i}", "html_url": "u", "created_at": "2024-01-01T00:00:00Z"} for i in range(50)
+    ])
+    conn = sqlite3.connect(TEST_DB)
+    keys = [row[0] for row in conn.execute(f"SELECT {database._SHUFFLE_SQL} FROM issues")]
+    conn.close()
+    assert len(set(keys)) == 50 and all(isinstance(key, int) for key in keys)
+
+    sampled = sorted(r.id for r in database.sample_issues_for_repo("r1", {"2024-01": 10}, columns=("id",)))
+    assert sampled != [base + i for i in range(10)]  # Not just storage order
+
+def _filter_fixture():
+    database.upsert_issues([
+        {"id": 1, "repo": "r1", "title": "crash", "html_url": "u", "created_at": "2024-01-05T00:00:00Z",
+         "updated_at": "2024-03-01T00:00:00Z", "comments": 4, "reactions": 10, "labels": ["bug", "p1"], "assignees": ["ana"]},
+        {"id": 2, "repo": "r1", "title": "docs", "html_url": "u", "created_at": "2024-02-05T00:00:00Z",
+         "updated_at": "2024-02-06T00:00:00Z", "comments": 0, "reactions": 1, "labels": ["docs"]},
+        {"id": 3, "repo": "r1", "title": "leak", "html_url": "u", "created_at": "2024-03-05T00:00:00Z",
+         "updated_at": "2024-03-06T00:00:00Z", "comments": 1, "reactions": 3, "labels": ["bug"], "assignees": ["bo"]},
+        {"id": 4, "repo": "r2", "title": "other", "html_url": "u", "created_at": "2024-01-05T00:00:00Z", "labels": ["bug"]},
+    ])
+
+def test_numeric_filters_use_indexes():
+    conn = sqlite3.connect(TEST_DB)
+    for column in ("comments", "reactions"):
+        plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN SELECT id FROM issues WHERE repo = ? AND {column} >= ?", ("r1", 1)))
+        assert f"idx_issues_repo_{column}" in plan
+    conn.close()
+
+def test_issue_filters_in_sql():
+    _filter_fixture()
+    ids = lambda **filters: [r.id for r in database.iter_issues_for_repo("r1", columns=("id",), filters=filters)]
+
+    assert ids() == [1, 2, 3]
+    assert ids(labels=["bug"]) == [1, 3]
+    assert ids(labels=["docs", "p1"]) == [1, 2]
+    assert ids(assignee="bo") == [3]
+    assert ids(created_after="2024-02-01", created_before="2024-03-01") == [2]
+    assert ids(updated_after="2024-03-01") == [1, 3]
+    assert ids(min_reactions=3, min_comments=2) == [1]
+    assert database.count_issues("r1", {"labels": ["bug"]}) == 2
+    assert database.count_issues_by_stratum("r1", {"labels": ["bug"]}) == {"2024-01/bug": 1, "2024-03/bug": 1}
+    with pytest.raises(ValueError):
+        database.count_issues("r1", {"milestone": "v1"})
+
+def test_labels_replaced_and_deleted():
+    _filter_fixture()
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "crash", "html_url": "u", "created_at": "d", "labels": ["p2"]})
+    assert database.count_issues("r1", {"labels": ["bug"]}) == 1
+    assert database.count_issues("r1", {"labels": ["p2"]}) == 1
+
+    database.delete_issues([1, 3])
+    conn = database.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM issue_labels WHERE issue_id IN (1, 3)").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM issue_assignees").fetchone()[0] == 0
+    conn.close()
+
+def test_get_issues_page_keyset():
+    _filter_fixture()
+    page = database.get_issues_page("r1", limit=2)
+    assert [i["id"] for i in page] == [1, 2]
+    assert page[0]["labels"] == ["bug", "p1"] and page[0]["assignees"] == ["ana"]
+    assert page[1]["assignees"] == []
+    after = database.issue_sort_key(page[-1], "id")
+    assert [i["id"] for i in database.get_issues_page("r1", after=after, limit=2)] == [3]
+
+    database.upsert_issue({"id": 0, "repo": "r1", "title": "late", "html_url": "u", "created_at": "2024-12-01T00:00:00Z"})
+    page = database.get_issues_page("r1", order_by="created_at", limit=3)
+    assert [i["id"] for i in page] == [1, 2, 3]
+    after = database.issue_sort_key(page[-1], "created_at")
+    assert [i["id"] for i in database.get_issues_page("r1", order_by="created_at", after=after)] == [0]
+
+    with pytest.raises(ValueError):
+        database.get_issues_page("r1", order_by="created_at", after=[5])
+
+def test_get_issues_page_across_null_created_at():
+    database.upsert_issues(
+        [{"id": i, "repo": "r1", "title": "undated", "html_url": "u", "created_at": None} for i in (5, 6, 7)]
+        + [{"id": i, "repo": "r1", "title": "dated", "html_url": "u", "created_at": "2024-01-01T00:00:00Z"} for i in (1, 2)]
+    )
+    seen, after = [], None
+    while True:
+        page = database.get_issues_page("r1", order_by="created_at", after=after, limit=2)
+        if not page:
+            break
+        seen.extend(i["id"] for i in page)
+        after = database.issue_sort_key(page[-1], "created_at")
+    # NULL dates sort first, and no row is skipped or repeated
+    assert seen == [5, 6, 7, 1, 2]
+
+    conn = sqlite3.connect(TEST_DB)
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM issues WHERE repo = ? AND (IFNULL(created_at, ''), id) > (?, ?) "
+        "ORDER BY IFNULL(created_at, ''), id", ("r1", "", 5)
+    ))
+    conn.close()
+    assert "idx_issues_repo_created_key" in plan and "TEMP B-TREE" not in plan
+
+def test_backfill_prompt_text():
+    database.upsert_issue({"id": 1, "repo": "r1", "title": "t1", "body": "b1", "html_url": "u", "created_at": "d"})
+    database.upsert_issue({"id": 2, "repo": "r1", "title": "t2", "html_url": "u", "created_at": "d", "prompt_text": "kept"})
+
+    assert database.backfill_prompt_text(lambda issue: f"fmt {issue['body']}") == 1
+
+    texts = {i["id"]: i["prompt_text"] for i in database.get_issues_for_repo("r1")}
+    assert texts == {1: "fmt b1", 2: "kept"}
+
+def test_upsert_issues_bulk():
+    database.upsert_issues([
+        {"id": i, "repo": "r1", "title": f"t{i}", "html_url": "u", "created_at": "d"} for i in range(3)
+    ])
+    database.upsert_issues([{"id": 1, "repo": "r1", "title": "updated", "html_url": "u", "created_at": "d"}])
+    database.upsert_issues([])
+
+    titles = {i["id"]: i["title"] for i in database.get_issues_for_repo("r1")}
+    assert titles == {0: "t0", 1: "updated", 2: "t2"}
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "issues.db"))
+    monkeypatch.setattr(database, "SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(database, "_shard_paths", {})
+
+    def use(mode):
+        monkeypatch.setattr(database, "SHARDING", mode)
+        database.init_db()
+        return tmp_path / "shards"
+    return use
+
+def test_repo_sharding_separates_files(sharded):
+    shards = sharded("repo")
+    assert database.count_issues("never/scanned") == 0
+    assert not shards.exists()
+
+    database.upsert_issues([
+        {"id": 1, "repo": "a/one", "title": "t1", "html_url": "u", "created_at": "d", "labels": ["bug"]},
+        {"id": 2, "repo": "b/two", "title": "t2", "html_url": "u", "created_at": "d"},
+    ])
+    assert len(list(shards.glob("*.db"))) == 2
+    assert database.get_all_issue_ids("a/one") == [1]
+    assert database.count_issues("b/two") == 1
+    assert database.count_issues("a/one", {"labels": ["bug"]}) == 1
+    # Issues stay out of the catalog
+    conn = database.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM issues").fetchone()[0] == 0
+    conn.close()
+
+    database.delete_issues([1], "a/one")
+    assert database.get_all_issue_ids("a/one") == []
+    database.delete_issues([2])
+    assert database.get_all_issue_ids("b/two") == []
+
+def test_hash_sharding_backfills_every_file(sharded, monkeypatch):
+    monkeypatch.setattr(database, "SHARD_COUNT", 2)
+    shards = sharded("hash")
+    for i in range(6):
+        database.upsert_issue({"id": i, "repo": f"o/r{i}", "title": "t", "body": "b", "html_url": "u", "created_at": "d"})
+
+    assert {p.name for p in shards.glob("*.db")} == {"issues-000.db", "issues-001.db"}
+    assert database.backfill_prompt_text(lambda issue: "fmt") == 6
+    assert all(database.get_issues_for_repo(f"o/r{i}")[0]["prompt_text"] == "fmt" for i in range(6))
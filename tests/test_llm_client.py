@@ -1,7 +1,8 @@
 
+import time
 import pytest
 from unittest.mock import MagicMock, patch
-from llm_client import get_llm_client, generate_analysis, MockLLM, OpenAILLM, AnthropicLLM, GeminiLLM
+from llm_client import get_llm_client, generate_analysis, generate_analysis_with_coverage, map_issue_chunks, MockLLM, OpenAILLM, AnthropicLLM, GeminiLLM, normalize_body, format_issue
 import httpx
 import os
 
@@ -85,6 +86,24 @@ def test_generate_analysis_map_reduce(mock_get_client):
     assert "Summary Chunk 1" in calls[2][0][0]
     assert "Summary Chunk 2" in calls[2][0][0]
 
+@patch("llm_client.get_llm_client")
+def test_map_and_reduce_share_cacheable_prefix(mock_get_client):
+    mock_llm = MagicMock()
+    mock_llm.get_chunk_size.return_value = 1
+    mock_llm.generate.return_value = "summary"
+    mock_get_client.return_value = mock_llm
+
+    issues = [{"id": i, "title": f"T{i}", "body": "B", "created_at": "D"} for i in range(3)]
+    generate_analysis("Do analysis", issues)
+
+    calls = mock_llm.generate.call_args_list
+    prefix = calls[0].kwargs["cache_prefix"]
+    assert "User Prompt: Do analysis" in prefix
+    # Every map call and the reduce start with the same prefix
+    assert all(call.kwargs["cache_prefix"] == prefix and call[0][0].startswith(prefix) for call in calls)
+    # Map prompts differ only after the issues begin
+    assert calls[0][0][0].split("Issues:")[0] == calls[1][0][0].split("Issues:")[0]
+
 
 # --- Provider Specific Tests (Mocking HTTP) ---
 
@@ -153,6 +172,41 @@ def test_anthropic_generate_success():
         resp = client.generate("test", 1)
         assert resp == "Claude Response"
 
+def test_anthropic_marks_only_long_prefixes_cacheable():
+    client = AnthropicLLM("key")
+    client.cache_min_tokens = 10
+    with patch("httpx.Client") as mock_client_cls:
+        mock_response = MagicMock(status_code=200)
+        mock_response.json.return_value = {"content": [{"text": "Claude Response"}]}
+        mock_post = mock_client_cls.return_value.__enter__.return_value.post
+        mock_post.return_value = mock_response
+
+        prefix = "shared instructions " * 3  # 60 characters, ~15 tokens
+        assert client.generate(prefix + "chunk", 1, cache_prefix=prefix) == "Claude Response"
+        content = mock_post.call_args.kwargs["json"]["messages"][0]["content"]
+        assert content[0] == {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}
+        assert content[1] == {"type": "text", "text": "chunk"}
+
+        # Below the model's minimum the prompt is sent as plain text
+        client.generate("short. chunk", 1, cache_prefix="short. ")
+        assert mock_post.call_args.kwargs["json"]["messages"][0]["content"] == "short. chunk"
+
+def test_anthropic_records_cache_usage():
+    import metrics
+    before = {d: metrics.LLM_TOKENS.value(provider="anthropic", direction=d) for d in ("cache_read", "cache_write")}
+    client = AnthropicLLM("key")
+    with patch("httpx.Client") as mock_client_cls:
+        mock_response = MagicMock(status_code=200)
+        mock_response.json.return_value = {
+            "content": [{"text": "Claude Response"}],
+            "usage": {"input_tokens": 10, "output_tokens": 5, "cache_creation_input_tokens": 2100, "cache_read_input_tokens": 300},
+        }
+        mock_client_cls.return_value.__enter__.return_value.post.return_value = mock_response
+        client.generate("prompt", 1)
+
+    assert metrics.LLM_TOKENS.value(provider="anthropic", direction="cache_write") - before["cache_write"] == 2100
+    assert metrics.LLM_TOKENS.value(provider="anthropic", direction="cache_read") - before["cache_read"] == 300
+
 def test_gemini_generate_success():
     client = GeminiLLM("key")
     with patch("httpx.Client") as mock_client_cls:
@@ -203,3 +257,148 @@ def test_mock_llm_generate():
     res = llm.generate("prompt", 10)
     assert "MOCK ANALYSIS RESULT" in res
 
+
+
+# --- Prompt Text Normalization Tests ---
+
+def test_normalize_body_strips_template_boilerplate():
+    body = (
+        "<!-- Please describe the bug -->\n"
+        "### Describe the bug\n\n"
+        "App crashes on start.\n\n"
+        "### Additional context\n\n"
+        "_No response_\n\n"
+        "- [X] I have searched existing issues\n"
+    )
+    text = normalize_body(body)
+    assert text == "### Describe the bug\nApp crashes on start."
+
+def test_normalize_body_folds_code_blocks():
+    trace = "\n".join(f"  frame {i}" for i in range(50))
+    body = f"Crash:\n```\n{trace}\nValueError: boom\n```\nPlease fix."
+    text = normalize_body(body)
+    assert "frame 0" in text
+    assert "frame 25" not in text
+    assert "ValueError: boom" in text
+    assert "lines folded" in text
+    assert text.endswith("Please fix.")
+
+def test_normalize_body_keeps_issue_references_and_nested_lists():
+    body = "#42 regressed again\n## Steps\nRun it\n- parent\n" + "\n".join(f"    - child {i}" for i in range(10))
+    text = normalize_body(body)
+    assert text.startswith("#42 regressed again\n## Steps")
+    assert all(f"    - child {i}" in text for i in range(10))
+
+def test_fold_lines_needs_more_than_one_omitted_line():
+    from llm_client import FOLD_KEEP_LINES, _fold_lines
+    lines = [f"l{i}" for i in range(2 * FOLD_KEEP_LINES + 1)]
+    assert _fold_lines(lines) == "\n".join(lines)
+    assert "[... 2 lines folded ...]" in _fold_lines(lines + ["extra"])
+
+def test_normalize_body_caps_length():
+    text = normalize_body("word " * 1000, max_chars=100)
+    assert len(text) <= 100 + len(" [truncated]")
+    assert text.endswith("[truncated]")
+
+def test_normalize_body_empty():
+    assert normalize_body(None) == ""
+    assert "No description" in format_issue({"id": 1, "title": "T", "body": None})
+
+@patch("llm_client.get_llm_client")
+def test_generate_analysis_uses_precomputed_prompt_text(mock_get_client):
+    mock_llm = MagicMock()
+    mock_llm.get_chunk_size.return_value = 10
+    mock_llm.generate.return_value = "Analysis Result"
+    mock_get_client.return_value = mock_llm
+
+    issues = [{"id": 1, "title": "T1", "body": "raw body", "prompt_text": "- #1 precomputed"}]
+    generate_analysis("Do analysis", issues)
+
+    args, _ = mock_llm.generate.call_args
+    assert "- #1 precomputed" in args[0]
+    assert "raw body" not in args[0]
+
+@patch("llm_client.get_llm_client")
+def test_generate_analysis_consumes_iterator_lazily(mock_get_client):
+    mock_llm = MagicMock()
+    mock_llm.get_chunk_size.return_value = 2
+    mock_get_client.return_value = mock_llm
+
+    consumed = []
+    def stream():
+        for i in range(3):
+            consumed.append(i)
+            yield {"id": i, "title": f"T{i}", "body": "B", "created_at": "D"}
+
+    def generate(prompt, total, **_):
+        # Only the current chunk has been pulled from the stream
+        assert len(consumed) <= (mock_llm.generate.call_count) * 2
+        return ["S1", "S2", "Final"][mock_llm.generate.call_count - 1]
+    mock_llm.generate.side_effect = generate
+
+    result = generate_analysis("Do analysis", stream(), total_issues=3)
+    assert result == "Final"
+    assert mock_llm.generate.call_count == 3
+
+
+# --- Metrics Instrumentation Tests ---
+
+def test_anthropic_records_token_usage():
+    import metrics
+    before_in = metrics.LLM_TOKENS.value(provider="anthropic", direction="in")
+    client = AnthropicLLM("key")
+    with patch("httpx.Client") as mock_client_cls:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "content": [{"text": "Claude Response"}],
+            "usage": {"input_tokens": 120, "output_tokens": 30}
+        }
+        mock_client_cls.return_value.__enter__.return_value.post.return_value = mock_response
+        client.generate("test", 1)
+
+    assert metrics.LLM_TOKENS.value(provider="anthropic", direction="in") == before_in + 120
+
+@patch("llm_client.get_llm_client")
+def test_generate_analysis_records_stage_latency(mock_get_client):
+    import metrics
+    mock_llm = MockLLM()
+    mock_get_client.return_value = mock_llm
+    before = metrics.LLM_REQUEST_SECONDS.count(provider="mock", stage="map")
+
+    issues = [{"id": i, "title": f"T{i}", "body": "B", "created_at": "D"} for i in range(45)]
+    generate_analysis("Do analysis", issues)
+
+    assert metrics.LLM_REQUEST_SECONDS.count(provider="mock", stage="map") == before + 3
+
+def test_map_issue_chunks_stops_dispatching_at_deadline():
+    client = MagicMock()
+    client.get_chunk_size.return_value = 2
+    client.generate.return_value = "summary"
+    issues = [{"id": i, "title": f"Issue {i}", "body": ""} for i in range(10)]
+
+    assert len(map_issue_chunks(client, "p", issues, 10)) == 5
+    # An expired deadline still summarizes the first chunk
+    client.generate.reset_mock()
+    summaries = map_issue_chunks(client, "p", issues, 10, deadline=time.monotonic())
+    assert len(summaries) == 1
+    assert client.generate.call_count == 1
+
+@patch("llm_client.get_llm_client")
+def test_generate_analysis_with_coverage_partial(mock_get_client):
+    mock_llm = MagicMock()
+    mock_llm.get_chunk_size.return_value = 2
+    mock_llm.generate.return_value = "summary"
+    mock_get_client.return_value = mock_llm
+    issues = [{"id": i, "title": f"Issue {i}", "body": ""} for i in range(10)]
+
+    analysis, covered = generate_analysis_with_coverage("p", issues, deadline=time.monotonic())
+    assert analysis == "summary"
+    assert covered == 2
+    # One map call, then the reduce is told what it is missing
+    assert mock_llm.generate.call_count == 2
+    assert "cover only 2 of 10 issues" in mock_llm.generate.call_args[0][0]
+
+    mock_llm.generate.reset_mock()
+    assert generate_analysis_with_coverage("p", issues)[1] == 10
+    assert "cover only" not in mock_llm.generate.call_args[0][0]
@@ -1,8 +1,13 @@
 
+import asyncio
+import json
+import sqlite3
+import time
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, MagicMock, patch
 from main import app, prune_stale_issues
+from llm_client import MockLLM
 import database
 
 client = TestClient(app)
@@ -18,9 +23,9 @@ def test_prune_stale_issues_logic(mock_delete, mock_get_ids):
     # 1 is stale (in DB but not fresh)
     # 4 is new (will be upserted elsewhere, pruning only cares about what to delete)
     
-    prune_stale_issues("repo", fresh_ids)
+    asyncio.run(prune_stale_issues("repo", fresh_ids))
     
-    mock_delete.assert_called_once_with([1])
+    mock_delete.assert_called_once_with([1], "repo")
 
 @patch("database.get_all_issue_ids")
 @patch("database.delete_issues")
@@ -28,17 +33,25 @@ def test_prune_stale_issues_no_stale(mock_delete, mock_get_ids):
     mock_get_ids.return_value = [1, 2]
     fresh_ids = {1, 2, 3}
     
-    prune_stale_issues("repo", fresh_ids)
+    asyncio.run(prune_stale_issues("repo", fresh_ids))
     
     mock_delete.assert_not_called()
 
 
 # --- API Endpoint Tests ---
 
+def test_metrics_endpoint():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE llm_request_seconds histogram" in response.text
+    assert "# TYPE github_pages_per_scan histogram" in response.text
+
 @patch("main.github_client.fetch_open_issues")
-@patch("database.upsert_issue")
+@patch("database.record_scan")
+@patch("database.upsert_issues")
 # We patch BackgroundTasks to ensure it's added but not necessarily executing the function in unit test unless we want to
-def test_scan_repo_success(mock_upsert, mock_fetch):
+def test_scan_repo_success(mock_upsert, mock_record, mock_fetch):
     mock_fetch.return_value = [
         {"id": 1, "title": "T1", "body": "B1", "html_url": "u1", "created_at": "d1"},
         {"id": 2, "title": "T2", "body": None, "html_url": "u2", "created_at": "d2"}
@@ -50,7 +63,9 @@ def test_scan_repo_success(mock_upsert, mock_fetch):
     data = response.json()
     assert data["repo"] == "owner/repo"
     assert data["issues_fetched"] == 2
-    assert mock_upsert.call_count == 2
+    # All issues are written in one batch
+    mock_upsert.assert_called_once()
+    assert len(mock_upsert.call_args[0][0]) == 2
     
 @patch("main.github_client.fetch_open_issues")
 def test_scan_repo_error(mock_fetch):
@@ -62,37 +77,346 @@ def test_scan_repo_error(mock_fetch):
     assert "GitHub API Down" in response.json()["detail"]
 
 
+@patch("main.github_client.fetch_open_issues")
+def test_scan_rate_limited_returns_429(mock_fetch):
+    from clients import RateLimitExhausted
+    mock_fetch.side_effect = RateLimitExhausted(time.time() + 120)
+
+    response = client.post("/scan", json={"repo": "owner/repo"})
+    assert response.status_code == 429
+    assert 110 <= int(response.headers["retry-after"]) <= 120
+
+    response = client.post("/scan/batch", json={"repos": ["owner/repo"]})
+    result = json.loads(response.text.splitlines()[0])
+    assert result["cached_successfully"] is False
+    assert 110 <= result["retry_after"] <= 120
+
+@patch("main.prune_stale_issues")
+@patch("database.record_scan")
+@patch("database.upsert_issues")
+@patch("main.github_client.fetch_open_issues")
+def test_scan_batch_streams_ndjson(mock_fetch, mock_upsert, mock_record, mock_prune):
+    async def fetch(repo, client=None):
+        if repo == "owner/missing":
+            raise Exception("Not Found")
+        return [{"id": hash(repo) % 1000, "title": "T", "body": None, "html_url": "u", "created_at": "d"}]
+    mock_fetch.side_effect = fetch
+
+    response = client.post("/scan/batch", json={"repos": ["owner/a", "owner/b", "owner/missing", "owner/a"]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {r["repo"]: r for r in map(json.loads, response.text.splitlines())}
+    assert set(results) == {"owner/a", "owner/b", "owner/missing"}  # Duplicates scanned once
+    assert results["owner/a"]["cached_successfully"] is True
+    assert results["owner/a"]["issues_fetched"] == 1
+    assert results["owner/missing"]["cached_successfully"] is False
+    assert "Not Found" in results["owner/missing"]["error"]
+    # Every scan shares one connection pool
+    clients = {call.kwargs["client"] for call in mock_fetch.call_args_list}
+    assert len(clients) == 1
+    assert mock_prune.call_count == 2
+
+@patch("main.prune_stale_issues")
+@patch("database.record_scan")
+@patch("database.upsert_issues")
+@patch("main.github_client.fetch_open_issues")
+def test_scan_batch_reports_cache_errors_per_repo(mock_fetch, mock_upsert, mock_record, mock_prune):
+    async def fetch(repo, client=None):
+        return [{"id": hash(repo) % 1000, "title": "T", "body": None, "html_url": "u", "created_at": "d"}]
+    mock_fetch.side_effect = fetch
+    def upsert(rows):
+        if any(row["repo"] == "owner/b" for row in rows):
+            raise sqlite3.OperationalError("database is locked")
+    mock_upsert.side_effect = upsert
+
+    response = client.post("/scan/batch", json={"repos": ["owner/a", "owner/b", "owner/c"]})
+
+    results = {r["repo"]: r for r in map(json.loads, response.text.splitlines())}
+    assert set(results) == {"owner/a", "owner/b", "owner/c"}
+    assert results["owner/b"]["cached_successfully"] is False
+    assert "database is locked" in results["owner/b"]["error"]
+    assert results["owner/a"]["cached_successfully"] is True and results["owner/c"]["cached_successfully"] is True
+
+@patch("database.record_analysis")
 @patch("database.is_repo_scanned")
-@patch("database.get_issues_for_repo")
-@patch("main.generate_analysis")
-def test_analyze_repo_success(mock_generate, mock_get_issues, mock_is_scanned):
+@patch("database.count_issues")
+@patch("database.iter_issues_for_repo")
+@patch("main.generate_analysis_with_coverage")
+def test_analyze_repo_success(mock_generate, mock_iter_issues, mock_count, mock_is_scanned, mock_record):
     mock_is_scanned.return_value = True
-    mock_get_issues.return_value = [{"id": 1}]
-    mock_generate.return_value = "Analysis Result"
+    mock_count.return_value = 1
+    mock_iter_issues.return_value = iter([{"id": 1}])
+    mock_generate.return_value = ("Analysis Result", 1)
     
     response = client.post("/analyze", json={"repo": "owner/repo", "prompt": "Analyze this"})
     
     assert response.status_code == 200
     assert response.json()["analysis"] == "Analysis Result"
+    # Issues are streamed with a projection that skips the raw body
+    _, kwargs = mock_iter_issues.call_args
+    assert "body" not in kwargs["columns"]
+    assert mock_generate.call_args.kwargs["total_issues"] == 1
 
 def test_analyze_repo_not_scanned():
     with patch("database.is_repo_scanned", return_value=False):
         response = client.post("/analyze", json={"repo": "unscanned", "prompt": "Analyze"})
         assert "not scanned" in response.json()["analysis"]
 
-def test_analyze_repo_no_issues():
+@patch("database.record_analysis")
+def test_analyze_repo_no_issues(mock_record):
     with patch("database.is_repo_scanned", return_value=True):
-        with patch("database.get_issues_for_repo", return_value=[]):
+        with patch("database.count_issues", return_value=0):
             response = client.post("/analyze", json={"repo": "empty", "prompt": "Analyze"})
             assert "No issues" in response.json()["analysis"]
 
+@patch("database.record_analysis")
 @patch("database.is_repo_scanned", return_value=True)
-@patch("database.get_issues_for_repo", return_value=[{"id": 1}])
-@patch("main.generate_analysis")
-def test_analyze_repo_llm_error(mock_generate, mock_get, mock_scan):
+@patch("database.count_issues", return_value=1)
+@patch("database.iter_issues_for_repo", return_value=iter([{"id": 1}]))
+@patch("main.generate_analysis_with_coverage")
+def test_analyze_repo_llm_error(mock_generate, mock_iter, mock_count, mock_scan, mock_record):
     mock_generate.side_effect = Exception("LLM connection failed")
     
     response = client.post("/analyze", json={"repo": "repo", "prompt": "Analyze"})
     
     assert response.status_code == 500
     assert "LLM connection failed" in response.json()["detail"]
+
+
+# --- Cross-Repo Analysis Tests ---
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "issues.db"))
+    database.init_db()
+
+async def _cache_fixture_repo(repo, titles):
+    from main import cache_issues
+    await cache_issues(repo, [
+        {"id": hash((repo, t)) % 10**6, "title": t, "body": None, "html_url": "u", "created_at": "d"}
+        for t in titles
+    ])
+
+def _scan_fixture_repo(repo, titles):
+    asyncio.run(_cache_fixture_repo(repo, titles))
+
+@patch("main.get_llm_client")
+def test_analyze_cross_repo_reuses_valid_summaries(mock_get_client, temp_db):
+    mock_llm = MagicMock()
+    mock_llm.get_chunk_size.return_value = 10
+    mock_llm.generate.side_effect = lambda prompt, total, **_: f"summary of {prompt[-40:]}"
+    mock_get_client.return_value = mock_llm
+
+    _scan_fixture_repo("org/a", ["A1", "A2"])
+    _scan_fixture_repo("org/b", ["B1"])
+
+    response = client.post("/analyze", json={"repos": ["org/a", "org/b"], "prompt": "Themes?"})
+    assert response.status_code == 200
+    # Two map calls (one per repo) and a single reduce
+    assert mock_llm.generate.call_count == 3
+    reduce_prompt, total = mock_llm.generate.call_args[0]
+    assert "Repository org/a" in reduce_prompt and "Repository org/b" in reduce_prompt
+    assert total == 3
+
+    # Unchanged repos reuse their map summaries; only the reduce runs again
+    mock_llm.generate.reset_mock()
+    client.post("/analyze", json={"repos": ["org/a", "org/b"], "prompt": "Themes?"})
+    assert mock_llm.generate.call_count == 1
+
+    # A rescan that changes org/b invalidates only its summary
+    _scan_fixture_repo("org/b", ["B1", "B2"])
+    mock_llm.generate.reset_mock()
+    client.post("/analyze", json={"repos": ["org/a", "org/b"], "prompt": "Themes?"})
+    assert mock_llm.generate.call_count == 2
+
+@patch("main.get_llm_client")
+def test_analyze_cross_repo_summaries_keyed_by_model(mock_get_client, temp_db, monkeypatch):
+    mock_llm = MagicMock(model="llama3")
+    mock_llm.get_chunk_size.return_value = 10
+    mock_llm.generate.return_value = "summary"
+    mock_get_client.return_value = mock_llm
+    _scan_fixture_repo("org/a", ["A1"])
+    _scan_fixture_repo("org/b", ["B1"])
+    payload = {"repos": ["org/a", "org/b"], "prompt": "Themes?"}
+
+    client.post("/analyze", json=payload)
+    mock_llm.generate.reset_mock()
+    client.post("/analyze", json=payload)
+    assert mock_llm.generate.call_count == 1  # Cached map summaries, reduce only
+
+    # A different model misses the cache
+    mock_llm.model = "mistral"
+    mock_llm.generate.reset_mock()
+    client.post("/analyze", json=payload)
+    assert mock_llm.generate.call_count == 3
+
+    # So does a changed map prompt template
+    import main
+    monkeypatch.setattr(main, "MAP_PROMPT_VERSION", "changed")
+    mock_llm.generate.reset_mock()
+    client.post("/analyze", json=payload)
+    assert mock_llm.generate.call_count == 3
+
+def test_analyze_cross_repo_unscanned(temp_db):
+    _scan_fixture_repo("org/a", ["A1"])
+    response = client.post("/analyze", json={"repos": ["org/a", "org/missing"], "prompt": "Themes?"})
+    assert "org/missing" in response.json()["analysis"]
+    assert "org/a" not in response.json()["analysis"]
+
+@patch("llm_client.get_llm_client")
+def test_analyze_debug_timing_breakdown(mock_get_client, temp_db):
+    from llm_client import MockLLM
+    mock_get_client.return_value = MockLLM()
+    _scan_fixture_repo("org/a", [f"A{i}" for i in range(30)])  # > MockLLM chunk size, forces map-reduce
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?"}, headers={"X-Debug-Timing": "1"})
+
+    timings = response.json()["timings"]
+    assert timings["stages"]["db.count_issues"]["count"] == 1
+    assert timings["stages"]["llm.map"]["count"] == 2
+    assert timings["stages"]["llm.reduce"]["count"] == 1
+    assert timings["stages"]["llm.format_chunk"]["count"] == 2
+    assert "llm.map;dur=" in response.headers["server-timing"]
+
+    # Off by default
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?"})
+    assert response.json()["timings"] is None
+    assert "server-timing" not in response.headers
+
+@patch("llm_client.get_llm_client")
+def test_analyze_deadline_returns_partial_coverage(mock_get_client, temp_db):
+    _scan_fixture_repo("org/a", ["A1", "A2", "A3"])
+    mock_llm = MagicMock()
+    mock_llm.get_chunk_size.return_value = 1
+
+    def slow_generate(prompt, total_issues, **_):
+        time.sleep(0.01)
+        return "summary"
+    mock_llm.generate.side_effect = slow_generate
+    mock_get_client.return_value = mock_llm
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?", "deadline_ms": 1})
+    body = response.json()
+    assert body["partial"] is True
+    assert body["coverage"] == pytest.approx(1 / 3, abs=1e-3)
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?"})
+    assert response.json()["partial"] is False
+    assert response.json()["coverage"] == 1.0
+
+@patch("llm_client.get_llm_client", return_value=MockLLM())
+def test_analyze_sampled_reports_ratio(mock_get_client, temp_db):
+    _scan_fixture_repo("org/a", [f"A{i}" for i in range(20)])
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?", "sample_size": 5})
+    body = response.json()
+    assert body["sampling_ratio"] == 0.25
+    assert body["coverage"] == 0.25
+    assert body["partial"] is False
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?"})
+    assert response.json()["sampling_ratio"] is None
+
+def test_build_issue_rows_keeps_metadata():
+    from main import build_issue_rows
+    row = build_issue_rows("o/r", [{
+        "id": 1, "title": "t", "body": None, "html_url": "u", "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-02T00:00:00Z", "comments": 3, "reactions": {"total_count": 7, "+1": 7},
+        "labels": [{"name": "bug"}, {"name": "p1"}], "assignees": [{"login": "ana"}],
+    }])[0]
+    assert row["labels"] == ["bug", "p1"]
+    assert row["assignees"] == ["ana"]
+    assert (row["updated_at"], row["comments"], row["reactions"]) == ("2024-01-02T00:00:00Z", 3, 7)
+
+@patch("llm_client.get_llm_client", return_value=MockLLM())
+def test_analyze_with_filters(mock_get_client, temp_db):
+    from main import cache_issues
+    asyncio.run(cache_issues("org/a", [
+        {"id": i, "title": f"A{i}", "body": None, "html_url": "u", "created_at": "2024-01-01T00:00:00Z",
+         "labels": [{"name": "bug" if i % 2 else "docs"}], "reactions": {"total_count": i}}
+        for i in range(10)
+    ]))
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Bugs?", "labels": ["bug"], "min_reactions": 5})
+    # Only issues 5, 7 and 9 match; MockLLM echoes the issue count it was given
+    assert "for 3 issues" in response.json()["analysis"]
+    assert response.json()["coverage"] == 1.0
+
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Bugs?", "labels": ["wontfix"]})
+    assert "match the filters" in response.json()["analysis"]
+
+def test_list_issues_keyset_pagination(temp_db):
+    _scan_fixture_repo("org/a", [f"A{i}" for i in range(5)])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/repos/org/a/issues", params=params).json()
+        seen.extend(issue["title"] for issue in page["issues"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(seen) == [f"A{i}" for i in range(5)]
+    assert len(seen) == 5
+
+    assert client.get("/repos/org/a/issues", params={"cursor": "not-a-cursor"}).status_code == 400
+    # Valid base64 JSON of the wrong shape
+    import main
+    for bad in (5, [[1]], "abc", {"id": 1}, [1, 2], [True], [None]):
+        bad_cursor = main.encode_cursor(bad)
+        assert client.get("/repos/org/a/issues", params={"cursor": bad_cursor}).status_code == 400
+        assert client.get("/repos/org/a/issues/export", params={"cursor": bad_cursor}).status_code == 400
+    assert client.get("/repos/org/a/issues", params={"order_by": "title"}).status_code == 422
+    assert client.get("/repos/org/missing/issues").status_code == 404
+
+def test_export_issues_ndjson(temp_db, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "EXPORT_BATCH_SIZE", 2)
+    _scan_fixture_repo("org/a", [f"A{i}" for i in range(5)])
+
+    response = client.get("/repos/org/a/issues/export", params={"order_by": "created_at"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(row["title"] for row in rows) == [f"A{i}" for i in range(5)]
+    assert len({row["id"] for row in rows}) == 5
+
+def test_analyze_sampling_validation():
+    for payload in (
+        {"repo": "a", "prompt": "p", "sample_size": 5, "confidence": 0.9},
+        {"repo": "a", "prompt": "p", "confidence": 1.5},
+        {"repos": ["a", "b"], "prompt": "p", "sample_size": 5},
+    ):
+        assert client.post("/analyze", json=payload).status_code == 422
+
+def test_analyze_rejects_non_positive_deadline():
+    response = client.post("/analyze", json={"repo": "org/a", "prompt": "Themes?", "deadline_ms": 0})
+    assert response.status_code == 422
+
+def test_analyze_requires_repo():
+    response = client.post("/analyze", json={"prompt": "Themes?"})
+    assert response.status_code == 422
+
+
+# --- Background Refresh Tests ---
+
+@pytest.mark.asyncio
+async def test_refresh_repo_incremental(temp_db):
+    from main import refresh_repo
+    await _cache_fixture_repo("org/a", ["A1", "A2"])
+    ids = sorted(database.get_all_issue_ids("org/a"))
+
+    updated = [
+        {"id": ids[0], "state": "closed", "title": "A1", "body": None, "html_url": "u", "created_at": "d"},
+        {"id": 555, "state": "open", "title": "A3", "body": None, "html_url": "u", "created_at": "d"},
+    ]
+    with patch("main.github_client.fetch_issues_since", new=AsyncMock(return_value=updated)) as mock_fetch:
+        assert await refresh_repo("org/a") is True
+        repo, since = mock_fetch.call_args[0]
+        assert repo == "org/a" and since.endswith("Z")
+
+    assert set(database.get_all_issue_ids("org/a")) == {ids[1], 555}
+
+    # Nothing updated since: cache and fingerprint are unchanged
+    with patch("main.github_client.fetch_issues_since", new=AsyncMock(return_value=[])):
+        assert await refresh_repo("org/a") is False
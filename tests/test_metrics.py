@@ -0,0 +1,54 @@
+import pytest
+import metrics
+
+@pytest.fixture(autouse=True)
+def isolated_registry(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+
+def test_counter_render():
+    counter = metrics.Counter("jobs_total", "Jobs run.", ["kind"])
+    counter.inc(kind="scan")
+    counter.inc(2, kind="scan")
+    counter.inc(kind='we"ird')
+
+    text = metrics.render()
+    assert "# TYPE jobs_total counter" in text
+    assert 'jobs_total{kind="scan"} 3' in text
+    assert 'jobs_total{kind="we\\"ird"} 1' in text
+
+def test_counter_rejects_wrong_labels():
+    counter = metrics.Counter("jobs_total", "Jobs run.", ["kind"])
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+
+def test_metric_without_samples_cannot_be_created():
+    class Incomplete(metrics._Metric):
+        kind = "untyped"
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete", "Missing _samples.")
+    assert metrics._registry == []
+
+def test_gauge_track_inprogress():
+    gauge = metrics.Gauge("in_progress", "Work in progress.")
+    with gauge.track_inprogress():
+        assert gauge.value() == 1
+    assert gauge.value() == 0
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+
+    text = metrics.render()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_sum 5.65" in text
+    assert "latency_seconds_count 4" in text
+
+def test_histogram_time():
+    histogram = metrics.Histogram("op_seconds", "Op.", ["op"])
+    with histogram.time(op="x"):
+        pass
+    assert histogram.count(op="x") == 1
@@ -0,0 +1,23 @@
+import pytest
+from sampling import allocate, sample_size_for_confidence, target_sample_size
+
+def test_sample_size_for_confidence():
+    # Textbook values at a 5% margin of error
+    assert sample_size_for_confidence(10**9, 0.95) == 385
+    assert sample_size_for_confidence(1000, 0.95) == 278
+    assert sample_size_for_confidence(50, 0.99) <= 50
+
+def test_target_sample_size():
+    assert target_sample_size(100, sample_size=500) == 100
+    assert target_sample_size(1000, sample_size=10) == 10
+    assert target_sample_size(1000) == 1000
+
+def test_allocate_proportional():
+    quotas = allocate({"2024-01": 50, "2024-02": 30, "2024-03": 20}, 10)
+    assert quotas == {"2024-01": 5, "2024-02": 3, "2024-03": 2}
+
+def test_allocate_largest_remainder():
+    quotas = allocate({"a": 1, "b": 1, "c": 1}, 2)
+    assert sum(quotas.values()) == 2
+    assert all(0 <= quotas[s] <= 1 for s in quotas)
+    assert allocate({"a": 3, "b": 1}, 10) == {"a": 3, "b": 1}
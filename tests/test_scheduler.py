@@ -0,0 +1,144 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+import database
+from clients import charge_request
+from scheduler import RefreshScheduler
+
+@pytest.fixture(autouse=True)
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "issues.db"))
+    database.init_db()
+
+def make_scheduler(refresh, **overrides):
+    github = MagicMock()
+    github.rate_limit_remaining = None
+    scheduler = RefreshScheduler(github, refresh)
+    scheduler.default_interval = 0  # Everything scanned in the past is due
+    for key, value in overrides.items():
+        setattr(scheduler, key, value)
+    return scheduler
+
+def seed_repo(repo, analyses=1):
+    database.record_scan(repo, "hash")
+    for _ in range(analyses):
+        database.record_analysis(repo)
+
+@pytest.mark.asyncio
+async def test_refreshes_only_hot_repos_hottest_first():
+    seed_repo("org/hot", analyses=3)
+    seed_repo("org/warm", analyses=1)
+    seed_repo("org/cold", analyses=0)
+
+    refresh = AsyncMock(return_value=False)
+    scheduler = make_scheduler(refresh)
+
+    assert await scheduler.run_once() == ["org/hot", "org/warm"]
+
+@pytest.mark.asyncio
+async def test_interval_adapts_to_changes():
+    scheduler = make_scheduler(AsyncMock(), min_interval=100, max_interval=1000)
+    assert scheduler.next_interval(400, changed=True) == 200
+    assert scheduler.next_interval(150, changed=True) == 100
+    assert scheduler.next_interval(400, changed=False) == 600
+    assert scheduler.next_interval(900, changed=False) == 1000
+
+@pytest.mark.asyncio
+async def test_changed_repo_gets_shorter_interval():
+    seed_repo("org/a")
+    database.set_refresh_interval("org/a", 0.0001)
+    time.sleep(0.001)
+
+    scheduler = make_scheduler(AsyncMock(return_value=True), min_interval=0)
+    await scheduler.run_once()
+
+    due = database.get_due_repos(time.time() + 10, 0, 3600)
+    assert due[0]["refresh_interval"] == pytest.approx(0.00005)
+
+@pytest.mark.asyncio
+async def test_stops_when_budget_spent():
+    seed_repo("org/a", analyses=2)
+    seed_repo("org/b", analyses=1)
+    scheduler = make_scheduler(None, budget_per_hour=3)
+
+    async def refresh(repo):
+        for _ in range(3):
+            charge_request()
+        return False
+    scheduler.refresh = refresh
+
+    assert await scheduler.run_once() == ["org/a"]
+    assert scheduler.budget_left(time.time()) == 0
+
+@pytest.mark.asyncio
+async def test_refresh_stops_paging_at_budget():
+    seed_repo("org/a")
+    scheduler = make_scheduler(None, budget_per_hour=3)
+    pages = []
+
+    async def refresh(repo):
+        for page in range(10):
+            charge_request()
+            pages.append(page)
+        return True
+    scheduler.refresh = refresh
+
+    assert await scheduler.run_once() == []
+    assert len(pages) == 3  # The budget is never overshot
+    assert scheduler.budget_left(time.time()) == 0
+
+@pytest.mark.asyncio
+async def test_foreground_requests_not_charged_to_refresh_budget():
+    seed_repo("org/a")
+    scheduler = make_scheduler(None, budget_per_hour=10)
+
+    refresh_started, scan_done = asyncio.Event(), asyncio.Event()
+
+    async def foreground_scan():
+        # A user scan runs in its own request task while the refresh is in flight
+        await refresh_started.wait()
+        for _ in range(50):
+            charge_request()
+        scan_done.set()
+    scan = asyncio.create_task(foreground_scan())
+
+    async def refresh(repo):
+        refresh_started.set()
+        await scan_done.wait()
+        charge_request()
+        return False
+    scheduler.refresh = refresh
+
+    assert await scheduler.run_once() == ["org/a"]
+    assert scheduler.budget_left(time.time()) == 9
+    await scan
+
+@pytest.mark.asyncio
+async def test_repo_without_row_becomes_hot_when_analyzed():
+    # Cached before the repos table existed: issues, but no repos row
+    database.upsert_issue({"id": 1, "repo": "org/legacy", "title": "t", "html_url": "u", "created_at": "d"})
+    database.record_analysis("org/legacy")
+
+    refresh = AsyncMock(return_value=False)
+    assert await make_scheduler(refresh).run_once() == ["org/legacy"]
+
+@pytest.mark.asyncio
+async def test_respects_rate_limit_reserve():
+    seed_repo("org/a")
+    refresh = AsyncMock(return_value=False)
+    scheduler = make_scheduler(refresh, rate_limit_reserve=100)
+    scheduler.github_client.rate_limit_remaining = 50
+
+    assert await scheduler.run_once() == []
+    refresh.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_failed_refresh_waits_before_retry():
+    seed_repo("org/a")
+    refresh = AsyncMock(side_effect=Exception("GitHub down"))
+    scheduler = make_scheduler(refresh, min_interval=60, max_interval=600)
+
+    assert await scheduler.run_once() == []
+    assert await scheduler.run_once() == []
+    assert refresh.call_count == 1
@@ -0,0 +1,52 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+def test_spans_nest_and_break_down():
+    with tracing.span("request") as root:
+        with tracing.span("db.query"):
+            pass
+        for _ in range(2):
+            with tracing.span("llm.map", provider="mock"):
+                tracing.increment("retries")
+
+    breakdown = root.breakdown()
+    assert breakdown["stages"]["db.query"]["count"] == 1
+    assert breakdown["stages"]["llm.map"]["count"] == 2
+    assert breakdown["tree"]["children"][1]["attrs"] == {"provider": "mock", "retries": 1}
+    assert "llm.map;dur=" in root.server_timing()
+    assert tracing.current_span() is None
+
+def test_root_span_exports_jsonl(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(trace_file))
+
+    with tracing.span("request") as root:
+        with tracing.span("child", n=1):
+            pass
+
+    records = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [r["name"] for r in records] == ["request", "child"]
+    assert records[1]["parent_id"] == root.span_id
+    assert {r["trace_id"] for r in records} == {root.trace_id}
+    assert records[1]["attrs"] == {"n": 1}
+
+def test_span_records_errors():
+    try:
+        with tracing.span("request") as root:
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert root.attrs["error"] == "ValueError"
+
+def test_wrap_propagates_parent_to_threads():
+    def work(i):
+        with tracing.span("worker", i=i):
+            pass
+
+    with tracing.span("request") as root:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(tracing.wrap(work), range(3)))
+
+    assert [child.name for child in root.children] == ["worker"] * 3
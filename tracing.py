@@ -0,0 +1,132 @@
+"""
+Lightweight per-request trace spans.
+
+`span(name)` opens a child of the current span (tracked in a contextvar, so it
+follows async tasks; use `wrap()` for thread pools). When a root span closes,
+its whole tree is appended to TRACE_FILE as JSONL, one span per line, if that
+variable is set. `Span.breakdown()` returns the per-stage timings that
+/analyze reports in debug mode.
+"""
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+_export_lock = threading.Lock()
+
+class Span:
+    __slots__ = ("name", "span_id", "trace_id", "parent", "start", "duration", "attrs", "children")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.span_id = next(_ids)
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent = parent
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.attrs = attrs
+        self.children: List["Span"] = []
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+    def walk(self) -> Iterator["Span"]:
+        yield self
+        for child in list(self.children):
+            yield from child.walk()
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": _ms(self.duration),
+            "attrs": self.attrs,
+        }
+
+    def tree(self) -> Dict[str, Any]:
+        node: Dict[str, Any] = {"name": self.name, "duration_ms": _ms(self.duration)}
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [child.tree() for child in self.children]
+        return node
+
+    def breakdown(self) -> Dict[str, Any]:
+        """Total time and call count per stage name, plus the full span tree."""
+        stages: Dict[str, Dict[str, Any]] = {}
+        for span in self.walk():
+            if span is self:
+                continue
+            stage = stages.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            stage["count"] += 1
+            stage["total_ms"] = round(stage["total_ms"] + (_ms(span.duration) or 0), 3)
+        return {"total_ms": _ms(self.duration), "stages": stages, "tree": self.tree()}
+
+    def server_timing(self) -> str:
+        """Stage totals formatted for the Server-Timing response header."""
+        stages = self.breakdown()["stages"]
+        entries = [f"{name};dur={stage['total_ms']}" for name, stage in stages.items()]
+        entries.append(f"total;dur={_ms(self.duration)}")
+        return ", ".join(entries)
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span]:
+    parent = _current.get()
+    current = Span(name, parent, attrs)
+    if parent is not None:
+        parent.children.append(current)
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current.reset(token)
+        if parent is None:
+            export(current)
+
+def annotate(**attrs: Any):
+    """Sets attributes on the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attrs)
+
+def increment(attr: str, amount: int = 1):
+    """Increments a counter attribute on the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.attrs[attr] = current.attrs.get(attr, 0) + amount
+
+def wrap(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Binds `fn` to the current context so spans opened in pool threads nest correctly."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+def export(root: Span):
+    if not TRACE_FILE:
+        return
+    lines = "".join(json.dumps(span.to_record(), default=str) + "\n" for span in root.walk())
+    with _export_lock:
+        with open(TRACE_FILE, "a") as f:
+            f.write(lines)